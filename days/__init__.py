@@ -6,6 +6,8 @@ from typing import Generator
 import requests
 
 from aocdays import AOCDays
+from intcode.profiler import Profiler
+from intcode.trace import TraceBuffer
 
 modules = filter(lambda x: not x.startswith('_'), glob.glob(os.path.dirname(__file__) + "/*.py"))
 __all__ = [os.path.basename(f)[:-3] for f in modules]
@@ -27,6 +29,16 @@ class AOCDay:
     input_filename = ""
     output_filename = ""
     input_data = None
+    # Number of worker processes days may fan independent work out to (see intcode.parallel)
+    workers = 1
+    # Profile every Intcode VM the day creates (see intcode.profiler)
+    profile = False
+    # Record an execution trace for every Intcode VM the day creates, dumped on exceptions (see intcode.trace)
+    trace = False
+    # Cache for pure Intcode runs, if enabled (see intcode.cache)
+    run_cache = None
+    # Continue long searches from their last checkpoint, if there is one (see intcode.checkpoint)
+    resume = False
 
     def __init__(self, year, day_number, session_token):
         self.year = year
@@ -60,7 +72,7 @@ class AOCDay:
     def load_input(self):
         if self.input_filename:
             with open(self.input_filename, 'r') as f:
-                self.input_data = [x.replace("\n", "") for x in f.readlines()]
+                self.input_data = f.read().splitlines()
                 if len(self.input_data) == 1:
                     self.input_data = self.input_data[0]
 
@@ -71,54 +83,92 @@ class AOCDay:
         if os.path.isfile(self.output_filename):
             os.remove(self.output_filename)
 
-        with open(self.output_filename, 'w') as output_file:
-            def dprint(thing):
-                print(thing, file=output_file)
-                print(thing)
-
-            input_data = self.input_data
-
-            start_time = time.time()
-            common = self.common(input_data)
-            if common:
-                dprint("== Common ==")
-                for x in common:
-                    dprint(x)
-                dprint("")
+        profilers = []
+        try:
+            with open(self.output_filename, 'w') as output_file:
+                def dprint(thing):
+                    print(thing, file=output_file)
+                    print(thing)
+
+                input_data = self.input_data
+                if self.trace:
+                    TraceBuffer.enable(path=self.output_filename + ".trace")
+
+                if self.profile:
+                    profilers.append(("part1", Profiler()))
+                    profilers[-1][1].enable()
+                start_time = time.time()
+                common = self.common(input_data)
+                if common:
+                    dprint("== Common ==")
+                    for x in common:
+                        dprint(x)
+                    dprint("")
     
-            dprint("== Part 1 ==")
-            part1 = self.part1(input_data)
-            printed = False
-            if part1:
-                for x in part1:
-                    if not printed:
-                        printed = True
-                    dprint(x)
-            if not printed:
-                dprint("(no output)")
-            dprint("== Ran in {:.3f} ms ==".format((time.time() - start_time)*1000))
-            dprint("")
-
-            start_time = time.time()
-            common = self.common(input_data)
-            if common:
-                dprint("== Common ==")
-                for x in common:
-                    dprint(x)
+                dprint("== Part 1 ==")
+                part1 = self.part1(input_data)
+                printed = False
+                if part1:
+                    for x in part1:
+                        if not printed:
+                            printed = True
+                        dprint(x)
+                if not printed:
+                    dprint("(no output)")
+                dprint("== Ran in {:.3f} ms ==".format((time.time() - start_time)*1000))
                 dprint("")
+
+                if self.profile:
+                    profilers[-1][1].disable()
+                    profilers.append(("part2", Profiler()))
+                    profilers[-1][1].enable()
+                start_time = time.time()
+                common = self.common(input_data)
+                if common:
+                    dprint("== Common ==")
+                    for x in common:
+                        dprint(x)
+                    dprint("")
     
-            dprint("== Part 2 ==")
-            part2 = self.part2(input_data)
-            printed = False
-            if part2:
-                for x in part2:
-                    if not printed:
-                        printed = True
-                    dprint(x)
-            if not printed:
-                dprint("(no output)")
-            dprint("== Ran in {:.3f} ms ==".format((time.time() - start_time)*1000))
-            dprint("")
+                dprint("== Part 2 ==")
+                part2 = self.part2(input_data)
+                printed = False
+                if part2:
+                    for x in part2:
+                        if not printed:
+                            printed = True
+                        dprint(x)
+                if not printed:
+                    dprint("(no output)")
+                dprint("== Ran in {:.3f} ms ==".format((time.time() - start_time)*1000))
+                dprint("")
+        finally:
+            # Also when a part raises, so later days do not report to these
+            if profilers:
+                profilers[-1][1].disable()
+            if self.trace:
+                TraceBuffer.disable()
+
+        if profilers:
+            self.write_profiles(profilers)
+        if self.run_cache is not None:
+            print(self.run_cache)
+
+    def checkpoint_path(self, name) -> str:
+        """File that long searches save their progress to, next to the output file"""
+        return "{}.{}.checkpoint".format(self.output_filename, name)
+
+    def write_profiles(self, profilers):
+        """Write the profile report and the collapsed stacks of every part next to the output file"""
+        with open(self.output_filename + ".profile", 'w') as f:
+            for part, profiler in profilers:
+                f.write("== {} ==\n".format(part))
+                f.write(profiler.report())
+                f.write("\n")
+        with open(self.output_filename + ".collapsed", 'w') as f:
+            for part, profiler in profilers:
+                f.write(profiler.collapsed(root="day{};{}".format(self.day_number, part)))
+        print("Profile written to {}.profile and {}.collapsed".format(self.output_filename, self.output_filename))
 
     def common(self, input_data) -> Generator:
         pass
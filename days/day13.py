@@ -1,290 +1,15 @@
-from collections import defaultdict
-from queue import Queue
-from typing import List
+from typing import Dict, List, Set, Tuple
 
 from days import AOCDay, day
+from intcode import VirtualMachine, Status
+from intcode.aot import AotVirtualMachine
+from intcode.loader import parse_program
 
 DEBUG = False
 INFO = False
 VISUALIZE = False
 
 
-class defaultlist(list):
-    def __init__(self, fx):
-        self._fx = fx
-    def _fill(self, index):
-        while len(self) <= index:
-            self.append(self._fx())
-    def __setitem__(self, index, value):
-        self._fill(index)
-        list.__setitem__(self, index, value)
-    def __getitem__(self, index):
-        self._fill(index)
-        return list.__getitem__(self, index)
-
-
-def add(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ add {} {} ".format(x, y), end="")
-    pc.memory[addr] = x + y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def mult(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ mul {} {} ".format(x, y), end="")
-    pc.memory[addr] = x * y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def i_input(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ inp {} ".format(addr))
-    if pc.input_queue.empty():
-        if INFO or DEBUG:
-            print("Waiting for input...")
-        return True
-    else:
-        if INFO or DEBUG:
-            print("Inputting...")
-        value = pc.input_queue.get()
-        pc.memory[addr] = value
-    return False
-
-def output(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ out {} ".format(addr))
-    if INFO or DEBUG:
-        print("Outputting...")
-    pc.output_queue.put(addr)
-
-def jump_if_true(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jit {} => {} ".format(x, addr))
-    if x != 0:
-        pc.pc = addr
-
-def jump_if_false(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jif {} => {} ".format(x, addr))
-    if x == 0:
-        pc.pc = addr
-
-def less_than(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ lt {} {} => {} ".format(x, y, addr))
-    if x < y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def equals(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ eq {} {} => {} ".format(x, y, addr))
-    if x == y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def rebase(pc, xarg):
-    xmode, x = xarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if DEBUG:
-        print("/ reb {} => {} ".format(x, pc.relative_base + x))
-    pc.relative_base += x
-
-
-INSTR_ADD = 1
-INSTR_MUL = 2
-INSTR_INP = 3
-INSTR_OUT = 4
-INSTR_JIT = 5
-INSTR_JIF = 6
-INSTR_LT = 7
-INSTR_EQ = 8
-INSTR_REB = 9
-INSTR_END = 99
-
-MODE_POS = 0
-MODE_IMM = 1
-MODE_REL = 2
-
-
-class VirtualMachine:
-    pc = 0
-    memory = defaultlist(lambda: 0)
-    initial_memory = defaultlist(lambda: 0)
-    input_queue: Queue = None
-    output_queue: Queue = None
-    waiting = False
-    relative_base = 0
-    breakpt = False
-    instr_set = {
-        # CONST: (func, nargs, name)
-        INSTR_ADD: (add, 3, "add"),
-        INSTR_MUL: (mult, 3, "mult"),
-        INSTR_INP: (i_input, 1, "in"),
-        INSTR_OUT: (output, 1, "out"),
-        INSTR_JIT: (jump_if_true, 2, "jit"),
-        INSTR_JIF: (jump_if_false, 2, "jif"),
-        INSTR_LT: (less_than, 3, "lt"),
-        INSTR_EQ: (equals, 3, "eq"),
-        INSTR_REB: (rebase, 1, "reb"),
-
-        INSTR_END: (lambda: None, 0, "end"),
-    }
-
-    def reset(self):
-        self.memory = defaultlist(0)
-        for i in self.initial_memory:
-            self.memory.append(i)
-        while not self.input_queue.empty():
-            self.input_queue.get()
-        while not self.output_queue.empty():
-            self.output_queue.get()
-        self.waiting = False
-        self.pc = 0
-        self.relative_base = 0
-
-    def initialize(self):
-        self.pc = 0
-        self.relative_base = 0
-
-    def run_instruction(self):
-        instr = self.memory[self.pc]
-        if self.waiting and not self.input_queue.empty():
-            if INFO or DEBUG:
-                print("Got input!")
-            # self.breakpt = True
-            self.waiting = False
-        if not self.waiting and instr != INSTR_END:
-            if DEBUG:
-                print("{}: ".format(self.pc), end="")
-
-            instr_opcode = int(str(instr)[-2:])
-            instr_modes = [int(x) for x in reversed(str(instr)[:-2])]
-            instr_func, instr_narg, instr_name = self.instr_set[instr_opcode]
-            while len(instr_modes) < instr_narg:
-                instr_modes.append(MODE_POS)  # Default mode
-
-            if DEBUG:
-                print("{} ".format(instr_name), end="")
-                for i in range(instr_narg):
-                    mode = "I" if instr_modes[i] == MODE_IMM else "@" if instr_modes[i] == MODE_POS else "#"
-                    print("{}{} ".format(mode, self.memory[self.pc + 1 + i]), end="")
-
-            instr_args = [(instr_modes[i], self.memory[self.pc + 1 + i]) for i in range(instr_narg)]
-
-            pc_pre = self.pc
-            res = instr_func(self, *instr_args)
-            if res:
-                self.waiting = True
-            else:
-                if pc_pre == self.pc:
-                    self.pc += 1 + instr_narg
-            if self.breakpt:
-                i = input("Step?")
-                if i == "n":
-                    self.breakpt = False
-            return False
-        elif not self.waiting:
-            return True
-        else:
-            return False
-
-    def run_program(self):
-        self.initialize()
-
-        while not self.run_instruction():
-            pass
-
-        return self.memory[0]
-
 EMPTY = 0
 WALL = 1
 BLOCK = 2
@@ -308,46 +33,109 @@ class Day13(AOCDay):
     virtual_machines: List[VirtualMachine] = []
     num_vms = 1
 
-    screen = defaultdict(lambda: EMPTY)
+    # (y, x) -> tile type, for every tile that is not EMPTY
+    screen: Dict[Tuple[int, int], int] = {}
+    # Tile type -> positions (y, x) of the tiles of that type, kept up to date by draw()
+    tiles: Dict[int, Set[Tuple[int, int]]] = {}
+    width = 0
+    height = 0
+    score = 0
 
     def common(self, input_data):
-        self.memory = list(map(int, input_data.split(',')))
+        self.memory = parse_program(input_data)
         self.virtual_machines = []
-        self.screen = defaultdict(lambda: EMPTY)
+        self.screen = {}
+        self.tiles = {tile_type: set() for tile_type in CHARS if tile_type != EMPTY}
+        self.width = self.height = 0
+        self.score = 0
         for i in range(self.num_vms):
-            vm = VirtualMachine()
-            vm.input_queue = Queue()
-            vm.output_queue = Queue()
-            for i in self.memory:
-                vm.memory.append(i)
-                vm.initial_memory.append(i)
-            self.virtual_machines.append(vm)
+            self.virtual_machines.append(AotVirtualMachine(self.memory))
 
     def print_screen(self):
-        prev_y = 0
         print("\033c", end="")
-        for y, x in sorted(self.screen.keys()):
-            if prev_y != y:
-                print("")
-            print(CHARS[self.screen[(y, x)]], end="")
-            prev_y = y
-        print("")
+        screen = self.screen
+        print("\n".join("".join(CHARS[screen.get((y, x), EMPTY)] for x in range(self.width))
+                        for y in range(self.height)))
+
+    def draw(self, output):
+        # Every 3 outputs draw one tile, or update the score
+        screen = self.screen
+        tiles = self.tiles
+        for screen_x, screen_y, tile_type in zip(*[iter(output)] * 3):
+            if INFO or DEBUG:
+                print("Output = {}".format((screen_x, screen_y, tile_type)))
+            if screen_x == -1 and screen_y == 0:
+                if VISUALIZE:
+                    print("New score: {}".format(tile_type))
+                self.score = tile_type
+                continue
+
+            position = (screen_y, screen_x)
+            old_type = screen.get(position, EMPTY)
+            if old_type == tile_type:
+                continue
+            if old_type != EMPTY:
+                tiles[old_type].discard(position)
+            if tile_type == EMPTY:
+                del screen[position]
+            else:
+                screen[position] = tile_type
+                tiles[tile_type].add(position)
+            self.width = max(self.width, screen_x + 1)
+            self.height = max(self.height, screen_y + 1)
+
+    def tile_x(self, tile_type):
+        """x-position of a tile of tile_type, or None if there is none"""
+        for _, x in self.tiles[tile_type]:
+            return x
+        return None
 
     @property
     def paddle_x(self):
-        p = [x for y, x in self.screen.keys() if self.screen[(y, x)] == PADDLE]
-        if p:
-            return p[0]
-        else:
-            return None
+        return self.tile_x(PADDLE)
 
     @property
     def ball_x(self):
-        p = [x for y, x in self.screen.keys() if self.screen[(y, x)] == BALL]
-        if p:
-            return p[0]
-        else:
-            return None
+        return self.tile_x(BALL)
+
+    @property
+    def blocks(self):
+        return len(self.tiles[BLOCK])
+
+    def play(self, vm: VirtualMachine) -> int:
+        """Play the game until it halts, moving the paddle towards the ball. Returns the number of frames."""
+        frames = 0
+        while True:
+            try:
+                status, output = vm.run_until()
+            except Exception as e:
+                print("=== EXCEPTION ===")
+                print("PC:", vm.pc)
+                print("Memory", vm.memory)
+                raise e
+
+            self.draw(output)
+            if status == Status.HALTED:
+                return frames
+            frames += 1
+
+            # Provide input
+            paddle_x = self.paddle_x
+            ball_x = self.ball_x
+            if paddle_x is not None and ball_x is not None:
+                # If the paddle is in the same x-position as the ball, provide NO_MOVE
+                if paddle_x == ball_x:
+                    vm.input_queue.put(NO_MOVE)
+                # If the paddle is in a higher x-position as the ball, provide LEFT (-1)
+                elif paddle_x > ball_x:
+                    vm.input_queue.put(LEFT)
+                # Else, the paddle is in a lower x-position as the ball, provide RIGHT (1)
+                else:
+                    vm.input_queue.put(RIGHT)
+            else:
+                vm.input_queue.put(NO_MOVE)
+            if VISUALIZE:
+                self.print_screen()
 
     def part1(self, input_data):
         vm_inputs = [[]]
@@ -356,37 +144,21 @@ class Day13(AOCDay):
             if INFO or DEBUG:
                 print("-- Input {} --".format(vm_input))
 
-            for j in vm_input:
-                self.virtual_machines[i].input_queue.put(j)
+            self.virtual_machines[i].input_queue.extend(vm_input)
 
-        states = [False for _ in self.virtual_machines]
         if INFO or DEBUG:
             print("Running virtual machines...")
-        screen_x, screen_y, tile_type = None, None, None
-        while not all([vm.memory[vm.pc] == INSTR_END for vm in self.virtual_machines]):
-            for i, vm in enumerate(self.virtual_machines):
-                try:
-                    states[i] = vm.run_instruction()
-                except Exception as e:
-                    print("=== EXCEPTION ===")
-                    print("PC:", vm.pc)
-                    print("Memory", vm.memory)
-                    raise e
-
-                # On 3x output, draw on screen
-                if not vm.output_queue.empty() and screen_x is None:
-                    screen_x = vm.output_queue.get()
-                elif not vm.output_queue.empty() and screen_y is None:
-                    screen_y = vm.output_queue.get()
-                elif not vm.output_queue.empty() and tile_type is None:
-                    tile_type = vm.output_queue.get()
-                if screen_x is not None and screen_y is not None and tile_type is not None:
-                    if INFO or DEBUG:
-                        print("Output = {}".format((screen_x, screen_y, tile_type)))
-                    self.screen[(screen_y, screen_x)] = tile_type
-                    screen_x, screen_y, tile_type = None, None, None
-
-        yield sum([1 for x in self.screen.values() if x == BLOCK])
+        for vm in self.virtual_machines:
+            try:
+                _, output = vm.run_until(stop_on_input=False)
+            except Exception as e:
+                print("=== EXCEPTION ===")
+                print("PC:", vm.pc)
+                print("Memory", vm.memory)
+                raise e
+            self.draw(output)
+
+        yield self.blocks
 
     def part2(self, input_data):
         vm_inputs = [[]]
@@ -397,55 +169,11 @@ class Day13(AOCDay):
             if INFO or DEBUG:
                 print("-- Input {} --".format(vm_input))
 
-            for j in vm_input:
-                self.virtual_machines[i].input_queue.put(j)
+            self.virtual_machines[i].input_queue.extend(vm_input)
 
-        states = [False for _ in self.virtual_machines]
         if INFO or DEBUG:
             print("Running virtual machines...")
-        screen_x, screen_y, tile_type = None, None, None
-        while not all(states):
-            for i, vm in enumerate(self.virtual_machines):
-                try:
-                    states[i] = vm.run_instruction()
-                    if vm.waiting:
-                        # Provide input
-                        if self.paddle_x is not None and self.ball_x is not None:
-                            # If the paddle is in the same x-position as the ball, provide NO_MOVE
-                            if self.paddle_x == self.ball_x:
-                                vm.input_queue.put(NO_MOVE)
-                            # If the paddle is in a higher x-position as the ball, provide LEFT (-1)
-                            elif self.paddle_x > self.ball_x:
-                                vm.input_queue.put(LEFT)
-                            # Else, the paddle is in a lower x-position as the ball, provide RIGHT (1)
-                            else:
-                                vm.input_queue.put(RIGHT)
-                        else:
-                            vm.input_queue.put(NO_MOVE)
-                        if VISUALIZE:
-                            self.print_screen()
-                except Exception as e:
-                    print("=== EXCEPTION ===")
-                    print("PC:", vm.pc)
-                    print("Memory", vm.memory)
-                    raise e
-
-                # On 3x output, draw on screen
-                if not vm.output_queue.empty() and screen_x is None:
-                    screen_x = vm.output_queue.get()
-                elif not vm.output_queue.empty() and screen_y is None:
-                    screen_y = vm.output_queue.get()
-                elif not vm.output_queue.empty() and tile_type is None:
-                    tile_type = vm.output_queue.get()
-                if screen_x is not None and screen_y is not None and tile_type is not None:
-                    if INFO or DEBUG:
-                        print("Output = {}".format((screen_x, screen_y, tile_type)))
-                    if screen_x == -1 and screen_y == 0:
-                        if VISUALIZE:
-                            print("New score: {}".format(tile_type))
-                        self.score = tile_type
-                    else:
-                        self.screen[(screen_y, screen_x)] = tile_type
-                    screen_x, screen_y, tile_type = None, None, None
+        for vm in self.virtual_machines:
+            self.play(vm)
 
         yield self.score
@@ -1,290 +1,17 @@
 import time
-from queue import Queue, PriorityQueue
+from collections import deque
+from queue import PriorityQueue
 from typing import List, Optional, Tuple, Dict
 
 from days import AOCDay, day
+from intcode import VirtualMachine, Status
+from intcode.loader import parse_program
 
 DEBUG = False
 INFO = False
 VISUALIZE = False
 
 
-class defaultlist(list):
-    def __init__(self, fx):
-        self._fx = fx
-    def _fill(self, index):
-        while len(self) <= index:
-            self.append(self._fx())
-    def __setitem__(self, index, value):
-        self._fill(index)
-        list.__setitem__(self, index, value)
-    def __getitem__(self, index):
-        self._fill(index)
-        return list.__getitem__(self, index)
-
-
-def add(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ add {} {} ".format(x, y), end="")
-    pc.memory[addr] = x + y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def mult(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ mul {} {} ".format(x, y), end="")
-    pc.memory[addr] = x * y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def i_input(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ inp {} ".format(addr))
-    if pc.input_queue.empty():
-        if INFO or DEBUG:
-            print("Waiting for input...")
-        return True
-    else:
-        if INFO or DEBUG:
-            print("Inputting...")
-        value = pc.input_queue.get()
-        pc.memory[addr] = value
-    return False
-
-def output(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ out {} ".format(addr))
-    if INFO or DEBUG:
-        print("Outputting...")
-    pc.output_queue.put(addr)
-
-def jump_if_true(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jit {} => {} ".format(x, addr))
-    if x != 0:
-        pc.pc = addr
-
-def jump_if_false(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jif {} => {} ".format(x, addr))
-    if x == 0:
-        pc.pc = addr
-
-def less_than(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ lt {} {} => {} ".format(x, y, addr))
-    if x < y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def equals(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ eq {} {} => {} ".format(x, y, addr))
-    if x == y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def rebase(pc, xarg):
-    xmode, x = xarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if DEBUG:
-        print("/ reb {} => {} ".format(x, pc.relative_base + x))
-    pc.relative_base += x
-
-
-INSTR_ADD = 1
-INSTR_MUL = 2
-INSTR_INP = 3
-INSTR_OUT = 4
-INSTR_JIT = 5
-INSTR_JIF = 6
-INSTR_LT = 7
-INSTR_EQ = 8
-INSTR_REB = 9
-INSTR_END = 99
-
-MODE_POS = 0
-MODE_IMM = 1
-MODE_REL = 2
-
-
-class VirtualMachine:
-    pc = 0
-    memory = defaultlist(lambda: 0)
-    initial_memory = defaultlist(lambda: 0)
-    input_queue: Queue = None
-    output_queue: Queue = None
-    waiting = False
-    relative_base = 0
-    breakpt = False
-    instr_set = {
-        # CONST: (func, nargs, name)
-        INSTR_ADD: (add, 3, "add"),
-        INSTR_MUL: (mult, 3, "mult"),
-        INSTR_INP: (i_input, 1, "in"),
-        INSTR_OUT: (output, 1, "out"),
-        INSTR_JIT: (jump_if_true, 2, "jit"),
-        INSTR_JIF: (jump_if_false, 2, "jif"),
-        INSTR_LT: (less_than, 3, "lt"),
-        INSTR_EQ: (equals, 3, "eq"),
-        INSTR_REB: (rebase, 1, "reb"),
-
-        INSTR_END: (lambda: None, 0, "end"),
-    }
-
-    def reset(self):
-        self.memory = defaultlist(0)
-        for i in self.initial_memory:
-            self.memory.append(i)
-        while not self.input_queue.empty():
-            self.input_queue.get()
-        while not self.output_queue.empty():
-            self.output_queue.get()
-        self.waiting = False
-        self.pc = 0
-        self.relative_base = 0
-
-    def initialize(self):
-        self.pc = 0
-        self.relative_base = 0
-
-    def run_instruction(self):
-        instr = self.memory[self.pc]
-        if self.waiting and not self.input_queue.empty():
-            if INFO or DEBUG:
-                print("Got input!")
-            # self.breakpt = True
-            self.waiting = False
-        if not self.waiting and instr != INSTR_END:
-            if DEBUG:
-                print("{}: ".format(self.pc), end="")
-
-            instr_opcode = int(str(instr)[-2:])
-            instr_modes = [int(x) for x in reversed(str(instr)[:-2])]
-            instr_func, instr_narg, instr_name = self.instr_set[instr_opcode]
-            while len(instr_modes) < instr_narg:
-                instr_modes.append(MODE_POS)  # Default mode
-
-            if DEBUG:
-                print("{} ".format(instr_name), end="")
-                for i in range(instr_narg):
-                    mode = "I" if instr_modes[i] == MODE_IMM else "@" if instr_modes[i] == MODE_POS else "#"
-                    print("{}{} ".format(mode, self.memory[self.pc + 1 + i]), end="")
-
-            instr_args = [(instr_modes[i], self.memory[self.pc + 1 + i]) for i in range(instr_narg)]
-
-            pc_pre = self.pc
-            res = instr_func(self, *instr_args)
-            if res:
-                self.waiting = True
-            else:
-                if pc_pre == self.pc:
-                    self.pc += 1 + instr_narg
-            if self.breakpt:
-                i = input("Step?")
-                if i == "n":
-                    self.breakpt = False
-            return False
-        elif not self.waiting:
-            return True
-        else:
-            return False
-
-    def run_program(self):
-        self.initialize()
-
-        while not self.run_instruction():
-            pass
-
-        return self.memory[0]
-
 NORTH = 1
 SOUTH = 2
 WEST = 3
@@ -360,19 +87,10 @@ class Day15(AOCDay):
 
     position: Point = None
     points: Dict[Tuple[int, int], Point] = {}
-    undiscovered: List[Point] = []
 
-    prev_move = None
     next_pos: Optional[Point] = None
     oxygen: Optional[Point] = None
 
-    def next_undiscovered(self):
-        if self.undiscovered:
-            sorted_undiscovereds = sorted(self.undiscovered, key=lambda x: self.manhattan_distance(self.position.position, x.position) + self.undiscovered.index(x))
-            dist = self.path_towards(self.position, sorted_undiscovereds[0])
-            return self.undiscovered[0], dist[0][1], dist[0][2], dist
-        return None, None, None, None
-
     def possible_moves(self, position: Point):
         moves = []
         if position.north is not None and position.north.ground != GROUND_WALL:
@@ -426,7 +144,6 @@ class Day15(AOCDay):
                 point.north.position = pos
                 point.north.south = point
                 self.points[pos] = point.north
-                self.undiscovered.append(point.north)
         if point.south is None:
             pos = point.position[0] + 1, point.position[1]
             if pos in self.points:
@@ -436,7 +153,6 @@ class Day15(AOCDay):
                 point.south.position = pos
                 point.south.north = point
                 self.points[pos] = point.south
-                self.undiscovered.append(point.south)
         if point.west is None:
             pos = point.position[0], point.position[1] - 1
             if pos in self.points:
@@ -446,7 +162,6 @@ class Day15(AOCDay):
                 point.west.position = pos
                 point.west.east = point
                 self.points[pos] = point.west
-                self.undiscovered.append(point.west)
         if point.east is None:
             pos = point.position[0], point.position[1] + 1
             if pos in self.points:
@@ -456,7 +171,6 @@ class Day15(AOCDay):
                 point.east.position = pos
                 point.east.west = point
                 self.points[pos] = point.east
-                self.undiscovered.append(point.east)
 
     def mark_position(self, output_from_program: int):
         if output_from_program == STATUS_WALL:
@@ -477,26 +191,6 @@ class Day15(AOCDay):
             self.oxygen = self.position
             if INFO or DEBUG:
                 print("Mark {} as OXYGEN".format(self.next_pos))
-        if self.next_pos in self.undiscovered:
-            self.undiscovered.remove(self.next_pos)
-
-    def do_step(self, output_from_program: Optional[int] = None):
-        if output_from_program is not None:
-            self.mark_position(output_from_program)
-
-        # Try to move to closest undiscovered cell
-        target, move, nextpoint, path = self.next_undiscovered()
-        if VISUALIZE:
-            self.print_screen()
-            time.sleep(0.005)
-        if INFO or DEBUG:
-            print("{}: {} - T:{} M:{} N:{}".format(self.position, output_from_program, target, move, nextpoint))
-            print("Path ", path)
-        if move:
-            self.next_pos = nextpoint
-            return move
-        else:
-            return None
 
     def print_screen(self):
         min_y = sorted(x[0] for x in self.points.keys())[0]
@@ -517,16 +211,10 @@ class Day15(AOCDay):
         print("")
 
     def common(self, input_data):
-        self.memory = list(map(int, input_data.split(',')))
+        self.memory = parse_program(input_data)
         self.virtual_machines = []
         for i in range(self.num_vms):
-            vm = VirtualMachine()
-            vm.input_queue = Queue()
-            vm.output_queue = Queue()
-            for i in self.memory:
-                vm.memory.append(i)
-                vm.initial_memory.append(i)
-            self.virtual_machines.append(vm)
+            self.virtual_machines.append(VirtualMachine(self.memory))
 
         # Build map once
         if self.position is None:
@@ -545,51 +233,50 @@ class Day15(AOCDay):
             self.position.west = Point()
             self.position.west.position = (0, -1)
             self.points[(0, -1)] = self.position.west
-            self.undiscovered = [self.position.north, self.position.south, self.position.west, self.position.east]
-            self.prev_move = None
             self.next_pos = None
             self.oxygen = None
             self.build_map()
 
     def build_map(self):
-        vm_inputs = [[self.do_step()]]
-
-        for i, vm_input in enumerate(vm_inputs):
-            if INFO or DEBUG:
-                print("-- Input {} --".format(vm_input))
-
-            for j in vm_input:
-                self.virtual_machines[i].input_queue.put(j)
-
-        states = [False for _ in self.virtual_machines]
+        """
+        Breadth-first search over droid states. Every reachable cell gets its own fork of the VM that walked there,
+        so trying a direction never has to be undone by walking back.
+        """
+        vm = self.virtual_machines[0]
         if INFO or DEBUG:
             print("Running virtual machines...")
-        screen_x, screen_y, tile_type = None, None, None
-        while not all([vm.memory[vm.pc] == INSTR_END for vm in self.virtual_machines]):
-            for i, vm in enumerate(self.virtual_machines):
+        vm.run_until()
+
+        to_explore = deque([(self.position, vm)])
+        while to_explore:
+            point, vm = to_explore.popleft()
+            for move, neighbour in ((NORTH, point.north), (SOUTH, point.south), (WEST, point.west), (EAST, point.east)):
+                if neighbour.ground != GROUND_UNKNOWN:
+                    continue
+                branch = vm.fork()
+                branch.input_queue.put(move)
                 try:
-                    states[i] = vm.run_instruction()
+                    status, output = branch.run_until()
                 except Exception as e:
                     print("=== EXCEPTION ===")
-                    print("PC:", vm.pc)
-                    print("Memory", vm.memory)
+                    print("PC:", branch.pc)
+                    print("Memory", branch.memory)
                     raise e
-
-                # Provide next step if VM is waiting
-                if vm.waiting:
-                    # Get VM output
-                    vm_output = None
-                    if not vm.output_queue.empty():
-                        vm_output = vm.output_queue.get()
-
-                    move = self.do_step(vm_output)
-                    if move:
-                        vm.input_queue.put(move)
-                    elif self.oxygen is not None:
-                        # Mapping complete
-                        return
-                    else:
-                        raise ValueError("Mapping complete but Oxygen not found!")
+                if status == Status.HALTED:
+                    raise ValueError("Droid halted while moving to {}".format(neighbour))
+
+                self.next_pos = neighbour
+                self.mark_position(output[0])
+                if neighbour.ground != GROUND_WALL:
+                    to_explore.append((neighbour, branch))
+                if VISUALIZE:
+                    self.print_screen()
+                    time.sleep(0.005)
+                if INFO or DEBUG:
+                    print("{}: {} - M:{}".format(point, output[0], move))
+
+        if self.oxygen is None:
+            raise ValueError("Mapping complete but Oxygen not found!")
 
     def part1(self, input_data):
         # Mapping should be complete, find shortest path to oxygen
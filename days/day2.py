@@ -1,7 +1,14 @@
+from functools import partial
+from typing import Dict, Optional, Tuple
+
 from days import AOCDay, day
+from intcode.parallel import make_executor
 
 DEBUG = False
 
+TARGET = 19690720
+
+
 def add(x, y):
     if DEBUG:
         print("add {} {} ".format(x, y), end="")
@@ -16,40 +23,158 @@ INSTR_ADD = 1
 INSTR_MUL = 2
 INSTR_END = 99
 
+instr_set = {
+    INSTR_ADD: add,
+    INSTR_MUL: mult,
+}
+instr_set_debug = {
+    INSTR_ADD: "add",
+    INSTR_MUL: "mul",
+    INSTR_END: "end",
+}
+
+
+class Polynomial:
+    """Polynomial in noun and verb, as a dict of (noun exponent, verb exponent) -> coefficient"""
+    def __init__(self, terms: Dict[Tuple[int, int], int]):
+        self.terms = {term: coefficient for term, coefficient in terms.items() if coefficient != 0}
+
+    @classmethod
+    def of(cls, value) -> 'Polynomial':
+        return value if isinstance(value, Polynomial) else cls({(0, 0): value})
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for term, coefficient in Polynomial.of(other).terms.items():
+            terms[term] = terms.get(term, 0) + coefficient
+        return Polynomial(terms)
+
+    def __mul__(self, other):
+        terms = {}
+        for (n1, v1), c1 in self.terms.items():
+            for (n2, v2), c2 in Polynomial.of(other).terms.items():
+                term = n1 + n2, v1 + v2
+                terms[term] = terms.get(term, 0) + c1 * c2
+        return Polynomial(terms)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __str__(self):
+        return " + ".join("{}*noun^{}*verb^{}".format(c, n, v) for (n, v), c in sorted(self.terms.items())) or "0"
+
+    @property
+    def linear(self):
+        return all(n + v <= 1 for n, v in self.terms)
+
+
+NOUN = Polynomial({(1, 0): 1})
+VERB = Polynomial({(0, 1): 1})
+
+
+def run_program(memory):
+    pc = 0
+    instr = memory[pc]
+    while instr != INSTR_END:
+        if DEBUG:
+            print("{}: {} @{} @{} => @{} / ".format(
+                pc, instr_set_debug[memory[pc]], memory[pc+1], memory[pc+2], memory[pc+3]
+            ), end="")
+        result = instr_set[instr](memory[memory[pc + 1]], memory[memory[pc + 2]])
+        memory[memory[pc + 3]] = result
+        if DEBUG:
+            print("=> {}".format(result))
+        pc += 4
+        instr = memory[pc]
+    return memory[0]
+
+
+def run_symbolic(memory) -> Optional[Polynomial]:
+    """
+    Run a program whose cells may hold Polynomials. A value read through a symbolic address is unknown (None), which
+    is fine as long as it is overwritten before it is used. Returns None if the result depends on an unknown value,
+    or if the program executes or writes through a symbolic cell.
+    """
+    pc = 0
+    instr = memory[pc]
+    while instr != INSTR_END:
+        if instr is None or isinstance(instr, Polynomial):
+            return None
+        x, y, target = memory[pc + 1], memory[pc + 2], memory[pc + 3]
+        if target is None or isinstance(target, Polynomial):
+            return None
+        x = None if x is None or isinstance(x, Polynomial) else memory[x]
+        y = None if y is None or isinstance(y, Polynomial) else memory[y]
+        memory[target] = None if x is None or y is None else instr_set[instr](x, y)
+        if DEBUG:
+            print("{}: {} => @{} = {}".format(pc, instr_set_debug[instr], target, memory[target]))
+        pc += 4
+        instr = memory[pc]
+    return None if memory[0] is None else Polynomial.of(memory[0])
+
+
+def search_noun(initial_memory, target, noun) -> Optional[int]:
+    """First verb for which the program returns target with the given noun. Module level for worker processes."""
+    for verb in range(100):
+        memory = initial_memory.copy()
+        memory[1] = noun
+        memory[2] = verb
+        if run_program(memory) == target:
+            return verb
+    return None
+
+
 @day(2)
 class Day2(AOCDay):
-    pc = 0
     memory = []
     initial_memory = []
-    instr_set = {
-        INSTR_ADD: add,
-        INSTR_MUL: mult,
-    }
-    instr_set_debug = {
-        INSTR_ADD: "add",
-        INSTR_MUL: "mul",
-        INSTR_END: "end",
-    }
 
     def reset(self):
         self.memory = self.initial_memory.copy()
 
-    def run_program(self):
-        self.pc = 0
-        instr = self.memory[self.pc]
-        while instr != INSTR_END:
-            if DEBUG:
-                print("{}: {} @{} @{} => @{} / ".format(
-                    self.pc, self.instr_set_debug[self.memory[self.pc]],
-                    self.memory[self.pc+1], self.memory[self.pc+2], self.memory[self.pc+3]
-                ), end="")
-            result = self.instr_set[instr](self.memory[self.memory[self.pc + 1]], self.memory[self.memory[self.pc + 2]])
-            self.memory[self.memory[self.pc + 3]] = result
-            if DEBUG:
-                print("=> {}".format(result))
-            self.pc += 4
-            instr = self.memory[self.pc]
-        return self.memory[0]
+    def run_program(self, symbolic=False):
+        """
+        Run the program on the current memory. In symbolic mode, noun and verb are replaced by the variables NOUN and
+        VERB and the result is memory[0] as a Polynomial in them, or None if it could not be derived.
+        """
+        if symbolic:
+            self.memory[1] = NOUN
+            self.memory[2] = VERB
+            return run_symbolic(self.memory)
+        return run_program(self.memory)
+
+    def solve(self, target) -> Optional[Tuple[int, int]]:
+        """
+        Solve result == target from the symbolic result of a single run. Returns None if that result could not be
+        derived or is not linear in noun and verb.
+        """
+        self.reset()
+        result = self.run_program(symbolic=True)
+        if DEBUG:
+            print("memory[0] = {}".format(result))
+        if result is None or not result.linear:
+            return None
+
+        a = result.terms.get((1, 0), 0)
+        b = result.terms.get((0, 1), 0)
+        c = result.terms.get((0, 0), 0)
+        for noun in range(100):
+            rest = target - c - a * noun
+            if b == 0:
+                if rest == 0:
+                    return noun, 0
+            elif rest % b == 0 and 0 <= rest // b < 100:
+                return noun, rest // b
+        return None
+
+    def brute_force(self, target) -> Optional[Tuple[int, int]]:
+        """Try every noun and verb, one noun per task on the worker processes"""
+        with make_executor(self.workers) as executor:
+            verbs = executor.map(partial(search_noun, self.initial_memory, target), range(100))
+            for noun, verb in enumerate(verbs):
+                if verb is not None:
+                    return noun, verb
+        return None
 
     def common(self, input_data):
         self.memory = list(map(int, input_data.split(',')))
@@ -62,17 +187,9 @@ class Day2(AOCDay):
 
 
     def part2(self, input_data):
-        for i in range(100):
-            for j in range(100):
-                self.memory[1] = i
-                self.memory[2] = j
-
-                if DEBUG:
-                    print("noun: {}, verb {}".format(i, j))
-                result = self.run_program()
-
-                if result == 19690720:
-                    yield (100 * i) + j
-                    return
-                else:
-                    self.reset()
+        solution = self.solve(TARGET)
+        if solution is None:
+            solution = self.brute_force(TARGET)
+        if solution is not None:
+            noun, verb = solution
+            yield (100 * noun) + verb
@@ -1,289 +1,16 @@
-from collections import defaultdict
-from queue import Queue
+import asyncio
 from typing import List
 
 from days import AOCDay, day
+from intcode import VirtualMachine
+from intcode.loader import parse_program
+from intcode.scheduler import Scheduler
 
 DEBUG = False
 INFO = False
 VISUALIZE = False
 
 
-class defaultlist(list):
-    def __init__(self, fx):
-        self._fx = fx
-    def _fill(self, index):
-        while len(self) <= index:
-            self.append(self._fx())
-    def __setitem__(self, index, value):
-        self._fill(index)
-        list.__setitem__(self, index, value)
-    def __getitem__(self, index):
-        self._fill(index)
-        return list.__getitem__(self, index)
-
-
-def add(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ add {} {} ".format(x, y), end="")
-    pc.memory[addr] = x + y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def mult(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-
-    if DEBUG:
-        print("/ mul {} {} ".format(x, y), end="")
-    pc.memory[addr] = x * y
-    if DEBUG:
-        print("=> @{}={}".format(addr, pc.memory[addr]))
-
-def i_input(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ inp {} ".format(addr))
-    if pc.input_queue.empty():
-        if INFO or DEBUG:
-            print("Waiting for input...")
-        return True
-    else:
-        if INFO or DEBUG:
-            print("Inputting...")
-        value = pc.input_queue.get()
-        pc.memory[addr] = value
-    return False
-
-def output(pc: 'VirtualMachine', addrarg):
-    addrmode, addr = addrarg
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ out {} ".format(addr))
-    if INFO or DEBUG:
-        print("Outputting...")
-    pc.output_queue.put(addr)
-
-def jump_if_true(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jit {} => {} ".format(x, addr))
-    if x != 0:
-        pc.pc = addr
-
-def jump_if_false(pc, xarg, addrarg):
-    xmode, x = xarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if addrmode == MODE_POS:
-        addr = pc.memory[addr]
-    elif addrmode == MODE_REL:
-        addr = pc.memory[pc.relative_base + addr]
-    if DEBUG:
-        print("/ jif {} => {} ".format(x, addr))
-    if x == 0:
-        pc.pc = addr
-
-def less_than(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ lt {} {} => {} ".format(x, y, addr))
-    if x < y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def equals(pc, xarg, yarg, addrarg):
-    xmode, x = xarg
-    ymode, y = yarg
-    addrmode, addr = addrarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if ymode == MODE_POS:
-        y = pc.memory[y]
-    elif ymode == MODE_REL:
-        y = pc.memory[pc.relative_base + y]
-    if addrmode == MODE_REL:
-        addr = pc.relative_base + addr
-    if DEBUG:
-        print("/ eq {} {} => {} ".format(x, y, addr))
-    if x == y:
-        pc.memory[addr] = 1
-    else:
-        pc.memory[addr] = 0
-
-def rebase(pc, xarg):
-    xmode, x = xarg
-    if xmode == MODE_POS:
-        x = pc.memory[x]
-    elif xmode == MODE_REL:
-        x = pc.memory[pc.relative_base + x]
-    if DEBUG:
-        print("/ reb {} => {} ".format(x, pc.relative_base + x))
-    pc.relative_base += x
-
-
-INSTR_ADD = 1
-INSTR_MUL = 2
-INSTR_INP = 3
-INSTR_OUT = 4
-INSTR_JIT = 5
-INSTR_JIF = 6
-INSTR_LT = 7
-INSTR_EQ = 8
-INSTR_REB = 9
-INSTR_END = 99
-
-MODE_POS = 0
-MODE_IMM = 1
-MODE_REL = 2
-
-
-class VirtualMachine:
-    pc = 0
-    memory = defaultlist(lambda: 0)
-    initial_memory = defaultlist(lambda: 0)
-    input_queue: Queue = None
-    output_queue: Queue = None
-    waiting = False
-    relative_base = 0
-    breakpt = False
-    instr_set = {
-        # CONST: (func, nargs, name)
-        INSTR_ADD: (add, 3, "add"),
-        INSTR_MUL: (mult, 3, "mult"),
-        INSTR_INP: (i_input, 1, "in"),
-        INSTR_OUT: (output, 1, "out"),
-        INSTR_JIT: (jump_if_true, 2, "jit"),
-        INSTR_JIF: (jump_if_false, 2, "jif"),
-        INSTR_LT: (less_than, 3, "lt"),
-        INSTR_EQ: (equals, 3, "eq"),
-        INSTR_REB: (rebase, 1, "reb"),
-
-        INSTR_END: (lambda: None, 0, "end"),
-    }
-
-    def reset(self):
-        self.memory = defaultlist(lambda: 0)
-        for i in self.initial_memory:
-            self.memory.append(i)
-        while not self.input_queue.empty():
-            self.input_queue.get()
-        while not self.output_queue.empty():
-            self.output_queue.get()
-        self.waiting = False
-        self.pc = 0
-        self.relative_base = 0
-
-    def initialize(self):
-        self.pc = 0
-        self.relative_base = 0
-
-    def run_instruction(self):
-        instr = self.memory[self.pc]
-        if self.waiting and not self.input_queue.empty():
-            if INFO or DEBUG:
-                print("Got input!")
-            # self.breakpt = True
-            self.waiting = False
-        if not self.waiting and instr != INSTR_END:
-            if DEBUG:
-                print("{}: ".format(self.pc), end="")
-
-            instr_opcode = int(str(instr)[-2:])
-            instr_modes = [int(x) for x in reversed(str(instr)[:-2])]
-            instr_func, instr_narg, instr_name = self.instr_set[instr_opcode]
-            while len(instr_modes) < instr_narg:
-                instr_modes.append(MODE_POS)  # Default mode
-
-            if DEBUG:
-                print("{} ".format(instr_name), end="")
-                for i in range(instr_narg):
-                    mode = "I" if instr_modes[i] == MODE_IMM else "@" if instr_modes[i] == MODE_POS else "#"
-                    print("{}{} ".format(mode, self.memory[self.pc + 1 + i]), end="")
-
-            instr_args = [(instr_modes[i], self.memory[self.pc + 1 + i]) for i in range(instr_narg)]
-
-            pc_pre = self.pc
-            res = instr_func(self, *instr_args)
-            if res:
-                self.waiting = True
-            else:
-                if pc_pre == self.pc:
-                    self.pc += 1 + instr_narg
-            if self.breakpt:
-                i = input("Step?")
-                if i == "n":
-                    self.breakpt = False
-            return False
-        elif not self.waiting:
-            return True
-        else:
-            return False
-
-    def run_program(self):
-        self.initialize()
-        while not self.run_instruction():
-            pass
-        return self.memory[0]
-
-
 @day(23)
 class Day23(AOCDay):
     virtual_machines: List[VirtualMachine] = []
@@ -291,39 +18,30 @@ class Day23(AOCDay):
 
     part = 1
 
-    packet_queues = defaultdict(lambda: [])
-    output_buffers = defaultdict(lambda: [])
-    # Indicates if a VM is waiting for a packet
-    recv_states = defaultdict(lambda: False)
-
     nat_x = None
     nat_y = None
 
-    nat_history = []
+    nat_history = set()
+
+    # Number of -1 reads in a row after which a VM sleeps until it gets a packet, if it is not found spinning on -1
+    # before that. Spin detection normally puts a VM to sleep after a couple of reads; this is the backstop for a
+    # program whose polling loop keeps changing its memory, so it never looks like it is spinning.
+    idle_reads = 16
+    scheduler: Scheduler = None
 
     def common(self, input_data):
-        self.memory = list(map(int, input_data.split(',')))
+        self.memory = parse_program(input_data)
         self.virtual_machines = []
         self.part = 1
-        self.packet_queues = defaultdict(lambda: [])
-        self.output_buffers = defaultdict(lambda: [])
         self.nat_x = None
         self.nat_y = None
-        self.nat_history = []
+        self.nat_history = set()
         for i in range(self.num_vms):
-            vm = VirtualMachine()
-            vm.input_queue = Queue()
-            vm.output_queue = Queue()
-            for i in self.memory:
-                vm.memory.append(i)
-                vm.initial_memory.append(i)
-            self.virtual_machines.append(vm)
+            self.virtual_machines.append(VirtualMachine(self.memory))
 
-    def run_vm(self, inputs: List[List[int]]) -> List[List[int]]:
-        outputs = []
+    def run_vm(self, inputs: List[List[int]]) -> int:
         for vm in self.virtual_machines:
             vm.reset()
-            outputs.append([])
 
         vm_inputs = inputs
 
@@ -331,73 +49,45 @@ class Day23(AOCDay):
             if INFO or DEBUG:
                 print("-- Input {} --".format(vm_input))
 
-            for j in vm_input:
-                self.virtual_machines[i].input_queue.put(j)
+            self.virtual_machines[i].input_queue.extend(vm_input)
 
-        states = [False for _ in self.virtual_machines]
         if INFO or DEBUG:
             print("Running virtual machines...")
-        while not all([vm.memory[vm.pc] == INSTR_END for vm in self.virtual_machines]):
-            for i, vm in enumerate(self.virtual_machines):
-                try:
-                    states[i] = vm.run_instruction()
-                except Exception as e:
-                    print("=== EXCEPTION ===")
-                    print("PC:", vm.pc)
-                    print("Memory", vm.memory)
-                    raise e
-
-                # Get VM output
-                if not vm.output_queue.empty():
-                    self.output_buffers[i].append(vm.output_queue.get())
-                    if len(self.output_buffers[i]) == 3:
-                        dest_addr = self.output_buffers[i].pop(0)
-                        x_val = self.output_buffers[i].pop(0)
-                        y_val = self.output_buffers[i].pop(0)
-                        if dest_addr == 255:
-                            if self.part == 1:
-                                return y_val
-                            else:
-                                if VISUALIZE:
-                                    print("{} sending to NAT : {} {}".format(i, x_val, y_val))
-                                self.nat_x, self.nat_y = x_val, y_val
-                        else:
-                            if VISUALIZE:
-                                print("{} sending to {} : {} {}".format(i, dest_addr, x_val, y_val))
-                            self.packet_queues[dest_addr].append((x_val, y_val))
-                if vm.waiting:
-                    if len(self.packet_queues[i]) == 0:
-                        if INFO:
-                            print("{} nothing to receive".format(i))
-                        vm.input_queue.put(-1)
-                        self.recv_states[i] = True
-                    else:
-                        x, y = self.packet_queues[i].pop(0)
-                        if VISUALIZE:
-                            print("{} receiving {} {}".format(i, x, y))
-                        vm.input_queue.put(x)
-                        vm.input_queue.put(y)
-                        self.recv_states[i] = False
-
-            # Process the NAT
-            result = self.process_nat()
-            if result:
-                # Value currently in nat_y has already been transmitted before!
-                return self.nat_y
-
-    def all_idle(self) -> bool:
-        return all(self.recv_states.values()) and all(len(queue) == 0 for queue in self.packet_queues.values())
+        self.scheduler = Scheduler(self.virtual_machines, self.route, self.process_nat, idle_reads=self.idle_reads)
+        try:
+            return asyncio.run(self.scheduler.run())
+        except Exception as e:
+            if self.scheduler.current is not None:
+                vm = self.virtual_machines[self.scheduler.current]
+                print("=== EXCEPTION ===")
+                print("PC:", vm.pc)
+                print("Memory", vm.memory)
+            raise e
+
+    def route(self, source: int, packet: List[int]):
+        dest_addr, x_val, y_val = packet
+        if dest_addr == 255:
+            if self.part == 1:
+                self.scheduler.stop(y_val)
+            else:
+                if VISUALIZE:
+                    print("{} sending to NAT : {} {}".format(source, x_val, y_val))
+                self.nat_x, self.nat_y = x_val, y_val
+        else:
+            if VISUALIZE:
+                print("{} sending to {} : {} {}".format(source, dest_addr, x_val, y_val))
+            self.scheduler.send(dest_addr, [x_val, y_val])
 
     def process_nat(self):
-        if self.all_idle() and self.nat_x is not None and self.nat_y is not None:
+        """Called by the scheduler once every VM is idle"""
+        if self.nat_x is not None and self.nat_y is not None:
             if VISUALIZE:
                 print("NAT sending to {} : {} {}".format(0, self.nat_x, self.nat_y))
-            self.packet_queues[0].append((self.nat_x, self.nat_y))
+            self.scheduler.send(0, [self.nat_x, self.nat_y])
             if self.nat_y in self.nat_history:
-                return True
-            self.nat_history.append(self.nat_y)
-        return False
-
+                # Value currently in nat_y has already been transmitted before!
+                self.scheduler.stop(self.nat_y)
+            self.nat_history.add(self.nat_y)
 
     def part1(self, input_data):
         yield self.run_vm([[i] for i in range(50)])
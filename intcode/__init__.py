@@ -0,0 +1,7 @@
+from intcode.channel import Channel
+from intcode.memory import Memory, make_image
+from intcode.vm import (
+    VirtualMachine, Snapshot, Status, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_OUT, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_REB, INSTR_END,
+    MODE_POS, MODE_IMM, MODE_REL,
+)
@@ -0,0 +1,368 @@
+"""
+Offline disassembler and control-flow-graph analyzer for Intcode program images.
+
+Disassembly is recursive: it starts at address 0 and follows fall-through and jump edges, so cells that are never
+reached as code end up in data regions. Jump targets come in three kinds:
+
+- static: an immediate target, or a position-mode target in a cell that no instruction writes to with a fixed address
+- computed: a target that is only known at run time (relative mode, or a cell the program writes to). These get an
+  edge to every constant the program stores that is the address of a valid instruction, which covers the
+  return-address pattern that Intcode programs use for calls. Jumps that rewrite their own target operand (jump
+  tables) also get an edge to every data cell value that is the address of a valid instruction
+- fall-through: the next instruction
+
+Targets read from memory, static or computed, are guesses: one is only kept if the code from there decodes into
+valid instructions that line up with the code found so far.
+
+Writes through relative addresses are assumed not to land in the program image, as they go to the stack in practice.
+
+Usage: python -m intcode.analysis <day number or program file> [--json FILE] [--dot FILE]
+"""
+import json
+import os
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from intcode.compiler import NARGS, VALID_MODES
+from intcode.loader import read_program
+from intcode.memory import Page
+from intcode.vm import (
+    VirtualMachine, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_END,
+    MODE_POS, MODE_IMM,
+)
+
+INPUTS_DIR = os.path.join(os.path.dirname(__file__), "../inputs")
+
+EDGE_FALLTHROUGH = "fallthrough"
+EDGE_STATIC = "static"
+EDGE_COMPUTED = "computed"
+
+
+class Instruction:
+    def __init__(self, pc: int, word: int, params: Tuple[int, ...]):
+        self.pc = pc
+        self.opcode, self.modes = decode(word)
+        self.valid = self.opcode == INSTR_END or (
+            self.opcode in NARGS and all(mode in VALID_MODES for mode in self.modes[:NARGS[self.opcode]]))
+        self.params = params[:NARGS.get(self.opcode, 0)] if self.valid else ()
+
+    @property
+    def size(self):
+        return 1 + len(self.params)
+
+    @property
+    def cells(self):
+        return range(self.pc, self.pc + self.size)
+
+    @property
+    def is_jump(self):
+        return self.opcode in (INSTR_JIT, INSTR_JIF)
+
+    @property
+    def is_terminator(self):
+        return not self.valid or self.opcode == INSTR_END or self.is_jump
+
+    @property
+    def falls_through(self):
+        """Whether execution can continue at the next instruction"""
+        if not self.valid or self.opcode == INSTR_END:
+            return False
+        if self.is_jump and self.modes[0] == MODE_IMM:
+            # Unconditional if the condition is immediate
+            return (self.params[0] != 0) == (self.opcode == INSTR_JIF)
+        return True
+
+    @property
+    def can_jump(self):
+        if not self.is_jump:
+            return False
+        if self.modes[0] == MODE_IMM:
+            return (self.params[0] != 0) == (self.opcode == INSTR_JIT)
+        return True
+
+    @property
+    def write_address(self) -> Optional[int]:
+        """Address this instruction writes to, if it is known without running the program"""
+        if not self.valid:
+            return None
+        if self.opcode in (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ) and self.modes[2] == MODE_POS:
+            return self.params[2]
+        if self.opcode == INSTR_INP and self.modes[0] == MODE_POS:
+            return self.params[0]
+        return None
+
+    @property
+    def constant(self) -> Optional[int]:
+        """Value this instruction stores, if both of its inputs are immediate"""
+        if not self.valid or self.opcode not in (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ) or self.modes[:2] != (MODE_IMM, MODE_IMM):
+            return None
+        x, y = self.params[:2]
+        if self.opcode == INSTR_ADD:
+            return x + y
+        elif self.opcode == INSTR_MUL:
+            return x * y
+        elif self.opcode == INSTR_LT:
+            return 1 if x < y else 0
+        return 1 if x == y else 0
+
+    def __str__(self):
+        if not self.valid:
+            return "{}: ??? {}".format(self.pc, self.opcode + 100 * (
+                self.modes[0] + 10 * self.modes[1] + 100 * self.modes[2]))
+        name = VirtualMachine.instr_set[self.opcode][2]
+        params = ("{}{}".format("@I#"[mode], param) for mode, param in zip(self.modes, self.params))
+        return "{}: {} {}".format(self.pc, name, " ".join(params)).rstrip()
+
+
+class BasicBlock:
+    def __init__(self, start: int):
+        self.start = start
+        self.instructions: List[Instruction] = []
+        # (target, edge kind)
+        self.successors: List[Tuple[int, str]] = []
+
+    @property
+    def end(self):
+        """Address after the last instruction"""
+        last = self.instructions[-1]
+        return last.pc + last.size
+
+
+class ControlFlowGraph:
+    def __init__(self, image: List[int]):
+        self.image = list(image)
+        self.instructions: Dict[int, Instruction] = {}
+        # Jump instruction -> (target, edge kind)
+        self.jumps: Dict[int, Set[Tuple[int, str]]] = {}
+        self.blocks: Dict[int, BasicBlock] = {}
+        # (writing instruction, written cell, instruction the cell is part of)
+        self.self_modifying: List[Tuple[int, int, int]] = []
+        # Cells that instructions write to with a fixed address
+        self.written: Set[int] = set()
+        self.analyze()
+
+    def cell(self, address):
+        return self.image[address] if 0 <= address < len(self.image) else 0
+
+    def decode(self, pc) -> Instruction:
+        return Instruction(pc, self.cell(pc), tuple(self.cell(pc + i) for i in range(1, 4)))
+
+    def explore(self, entries):
+        to_visit = list(entries)
+        while to_visit:
+            pc = to_visit.pop()
+            if pc in self.instructions or pc < 0:
+                continue
+            instruction = self.instructions[pc] = self.decode(pc)
+            if instruction.falls_through:
+                to_visit.append(pc + instruction.size)
+            if instruction.can_jump:
+                self.jumps[pc] = set()
+                # Targets read from memory, and jumps on a condition read from memory, are left to analyze()
+                if self.certain_target(instruction):
+                    self.jumps[pc].add((instruction.params[1], EDGE_STATIC))
+                    to_visit.append(instruction.params[1])
+
+    def explore_target(self, entry: int, code: Dict[int, int]) -> bool:
+        """
+        Explore from a jump target read from memory, which is only a guess. What is found is kept only if it is all valid
+        instructions that do not overlap the ones found so far, where code maps every cell of those to the
+        instruction it is part of. Returns whether it was kept.
+        """
+        found: Dict[int, Instruction] = {}
+        found_cells: Set[int] = set()
+        to_visit = [entry]
+        while to_visit:
+            pc = to_visit.pop()
+            if pc in self.instructions or pc in found:
+                continue
+            instruction = self.decode(pc)
+            if pc < 0 or not instruction.valid or any(cell in code or cell in found_cells
+                                                      for cell in instruction.cells):
+                return False
+            found[pc] = instruction
+            found_cells.update(instruction.cells)
+            if instruction.falls_through:
+                to_visit.append(pc + instruction.size)
+            if self.certain_target(instruction):
+                to_visit.append(instruction.params[1])
+
+        self.explore([entry])
+        for pc in found:
+            code.update((cell, pc) for cell in self.instructions[pc].cells)
+        return True
+
+    def certain_target(self, instruction: Instruction) -> bool:
+        """Whether a jump is followed while exploring: the target is immediate and so is the condition, if any"""
+        return (instruction.can_jump and instruction.modes[0] != MODE_POS and instruction.modes[1] == MODE_IMM and
+                instruction.pc + 2 not in self.written)
+
+    def may_jump(self, instruction: Instruction) -> bool:
+        """Whether a jump can be taken, also when its condition is in a cell that no instruction writes to"""
+        mode, param = instruction.modes[0], instruction.params[0]
+        if mode == MODE_POS and param not in self.written and instruction.pc + 1 not in self.written:
+            return (self.cell(param) != 0) == (instruction.opcode == INSTR_JIT)
+        return instruction.can_jump
+
+    def static_target(self, instruction: Instruction) -> Optional[int]:
+        mode, param = instruction.modes[1], instruction.params[1]
+        if instruction.pc + 2 in self.written:
+            return None
+        if mode == MODE_IMM:
+            return param
+        if mode == MODE_POS and param not in self.written:
+            return self.cell(param)
+        return None
+
+    def code_pointers(self, values) -> Set[int]:
+        """The values that are the address of a valid instruction"""
+        return {v for v in values if v is not None and 0 <= v < len(self.image) and self.decode(v).valid}
+
+    def code_cells(self) -> Dict[int, int]:
+        """Cell -> the instruction it is part of"""
+        cells = {}
+        for instruction in self.instructions.values():
+            for cell in instruction.cells:
+                cells[cell] = instruction.pc
+        return cells
+
+    def data_cells(self) -> List[int]:
+        code = self.code_cells()
+        return [address for address in range(len(self.image)) if address not in code]
+
+    def analyze(self):
+        # Explore from the entry point, then keep adding the targets of jumps that read them from memory until no
+        # new code is found. For computed jumps, those are stored constants that look like code addresses.
+        self.explore([0])
+        # Targets that turned out not to be code
+        rejected = set()
+        while True:
+            self.written = {i.write_address for i in self.instructions.values() if i.write_address is not None}
+            constants = self.code_pointers(i.constant for i in self.instructions.values())
+            table = None
+            unexplored = set()
+            for pc in self.jumps:
+                instruction = self.instructions[pc]
+                target = self.static_target(instruction)
+                if not self.may_jump(instruction):
+                    candidates, kind = set(), EDGE_STATIC
+                elif target is not None:
+                    candidates, kind = {target}, EDGE_STATIC
+                elif pc + 2 in self.written:
+                    # The program rewrites the target operand itself, which is how jump tables are indexed. The
+                    # table is somewhere in the data, so every data cell that holds a code address is a candidate.
+                    if table is None:
+                        table = self.code_pointers(self.cell(address) for address in self.data_cells())
+                    candidates, kind = constants | table, EDGE_COMPUTED
+                else:
+                    candidates, kind = constants, EDGE_COMPUTED
+                self.jumps[pc] = {(target, kind) for target in candidates if target not in rejected}
+                unexplored.update(c for c in candidates if c not in self.instructions and c not in rejected)
+            if not unexplored:
+                break
+            code = self.code_cells()
+            for target in sorted(unexplored):
+                if not self.explore_target(target, code):
+                    rejected.add(target)
+
+        code_cells = self.code_cells()
+        for instruction in sorted(self.instructions.values(), key=lambda i: i.pc):
+            address = instruction.write_address
+            if address in code_cells:
+                self.self_modifying.append((instruction.pc, address, code_cells[address]))
+        self.build_blocks()
+
+    def build_blocks(self):
+        leaders = {0}
+        for pc, targets in self.jumps.items():
+            leaders.update(target for target, _ in targets)
+        for instruction in self.instructions.values():
+            if instruction.is_terminator:
+                leaders.add(instruction.pc + instruction.size)
+        leaders &= self.instructions.keys()
+
+        for start in sorted(leaders):
+            block = self.blocks[start] = BasicBlock(start)
+            pc = start
+            while True:
+                instruction = self.instructions[pc]
+                block.instructions.append(instruction)
+                pc += instruction.size
+                if instruction.is_terminator or pc in leaders or pc not in self.instructions:
+                    break
+            last = block.instructions[-1]
+            if last.falls_through:
+                block.successors.append((pc, EDGE_FALLTHROUGH))
+            block.successors.extend(sorted(self.jumps.get(last.pc, ())))
+
+    def data_regions(self) -> List[Tuple[int, int]]:
+        """Ranges [start, end) of image cells that are never executed"""
+        regions = []
+        for address in self.data_cells():
+            if regions and regions[-1][1] == address:
+                regions[-1] = (regions[-1][0], address + 1)
+            else:
+                regions.append((address, address + 1))
+        return regions
+
+    def to_json(self) -> dict:
+        return {
+            "size": len(self.image),
+            "entry": 0,
+            "blocks": [{
+                "start": block.start,
+                "end": block.end,
+                "instructions": [str(instruction) for instruction in block.instructions],
+                "successors": [{"target": target, "kind": kind} for target, kind in block.successors],
+            } for block in self.blocks.values()],
+            "data": [list(region) for region in self.data_regions()],
+            "self_modifying": [{"pc": pc, "cell": cell, "instruction": target}
+                               for pc, cell, target in self.self_modifying],
+        }
+
+    def to_dot(self) -> str:
+        lines = ["digraph intcode {", '    node [shape=box, fontname="monospace"];']
+        for block in self.blocks.values():
+            label = "".join(str(instruction).replace('"', '\\"') + "\\l" for instruction in block.instructions)
+            lines.append('    b{} [label="{}"];'.format(block.start, label))
+        styles = {EDGE_FALLTHROUGH: "solid", EDGE_STATIC: "bold", EDGE_COMPUTED: "dashed"}
+        for block in self.blocks.values():
+            for target, kind in block.successors:
+                if target in self.blocks:
+                    lines.append("    b{} -> b{} [style={}];".format(block.start, target, styles[kind]))
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        code_size = len(self.code_cells())
+        return "\n".join([
+            "{} cells, {} instructions in {} basic blocks covering {} cells".format(
+                len(self.image), len(self.instructions), len(self.blocks), code_size),
+            "{} jumps, {} with computed targets".format(
+                len(self.jumps), sum(1 for targets in self.jumps.values()
+                                     if any(kind == EDGE_COMPUTED for _, kind in targets))),
+            "{} data regions, {} self-modifying writes".format(len(self.data_regions()), len(self.self_modifying)),
+        ])
+
+
+def load_program(source) -> Page:
+    """Load a program from a day number (read from inputs/) or a file path"""
+    path = os.path.join(INPUTS_DIR, "day{}_input".format(source)) if str(source).isdigit() else source
+    return read_program(path)
+
+
+def main(args):
+    if not args:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    graph = ControlFlowGraph(load_program(args[0]))
+    print(graph.summary())
+    for flag, export in (("--json", lambda: json.dumps(graph.to_json(), indent=2)), ("--dot", graph.to_dot)):
+        if flag in args:
+            with open(args[args.index(flag) + 1], 'w') as f:
+                f.write(export())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
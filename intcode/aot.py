@@ -0,0 +1,165 @@
+"""
+Ahead-of-time compiler. Translates a whole program image into a Python module with one function per basic block
+(generated like intcode.compiler does at run time) and a dispatch table from start address to block, and caches the
+module in .aot_cache/, keyed by a digest of the image. Later runs import the module, which Python in turn caches as
+bytecode, so a VM starts out with every block it can find ready to run.
+
+Blocks are generated from every leader the control-flow graph analysis finds (see intcode.analysis), every input
+instruction (where a VM resumes after waiting for input) and the address after every generated block. Blocks for
+any other address are still compiled at run time, and writes to code drop the blocks compiled from it as usual.
+
+Precompile a program with: python -m intcode.aot <day number or program file> [--check]
+"""
+import importlib.util
+import os
+import sys
+from types import ModuleType
+from typing import Dict, Iterable, List
+
+from intcode.analysis import ControlFlowGraph, load_program
+from intcode.cache import program_digest
+from intcode.compiler import BlockBuilder, CompiledVirtualMachine
+from intcode.memory import Memory, make_image
+from intcode.vm import INSTR_INP
+
+# Bump when the generated code changes, so stale modules are regenerated
+VERSION = 2
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "../.aot_cache")
+
+# Digest -> loaded module
+_modules: Dict[str, ModuleType] = {}
+
+
+def generate_module(program: Iterable[int]) -> str:
+    image = make_image(program)
+    memory = Memory(image)
+    graph = ControlFlowGraph(image)
+    to_visit = sorted(set(graph.blocks) | {pc for pc, instruction in graph.instructions.items()
+                                            if instruction.opcode == INSTR_INP}, reverse=True)
+    blocks: Dict[int, List[int]] = {}
+    functions = []
+    while to_visit:
+        start = to_visit.pop()
+        if start in blocks:
+            continue
+        builder = BlockBuilder(memory, start)
+        source = builder.generate()
+        if source is None:
+            continue
+        blocks[start] = builder.cells
+        functions.append(source.replace("def block(vm):", "def block_{}(vm):".format(start), 1))
+        if builder.end in graph.instructions:
+            to_visit.append(builder.end)
+
+    code: Dict[int, List[int]] = {}
+    for start, cells in sorted(blocks.items()):
+        for cell in cells:
+            code.setdefault(cell, []).append(start)
+    lines = [
+        '"""Generated by intcode.aot from a program with digest {}"""'.format(program_digest(image)),
+        "VERSION = {}".format(VERSION),
+        "",
+    ]
+    for function in functions:
+        lines.extend(["", function, ""])
+    lines.append("")
+    lines.append("BLOCKS = {{{}}}".format(", ".join("{0}: block_{0}".format(start) for start in sorted(blocks))))
+    # Cell -> start addresses of the blocks that were compiled from it
+    lines.append("CODE = {{{}}}".format(", ".join("{}: {}".format(cell, tuple(starts))
+                                                  for cell, starts in sorted(code.items()))))
+    return "\n".join(lines) + "\n"
+
+
+def module_path(digest: str) -> str:
+    return os.path.join(CACHE_DIR, "{}.py".format(digest))
+
+
+def import_module(digest: str) -> ModuleType:
+    spec = importlib.util.spec_from_file_location("intcode_aot_{}".format(digest), module_path(digest))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_module(program: Iterable[int]) -> ModuleType:
+    """Compiled module for a program, from the cache if it is there, otherwise generated and written to it"""
+    digest = program_digest(program)
+    module = _modules.get(digest)
+    if module is not None:
+        return module
+
+    if os.path.exists(module_path(digest)):
+        try:
+            module = import_module(digest)
+        except Exception:
+            # A truncated or corrupt file, or one from an older version that no longer imports
+            module = None
+        if getattr(module, "VERSION", None) != VERSION:
+            module = None
+    if module is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first, so a concurrent run never imports half a module
+        temp_path = "{}.{}.tmp".format(module_path(digest), os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write(generate_module(program))
+        os.replace(temp_path, module_path(digest))
+        module = import_module(digest)
+    _modules[digest] = module
+    return module
+
+
+class AotVirtualMachine(CompiledVirtualMachine):
+    """CompiledVirtualMachine that starts with all blocks from the ahead-of-time compiled module of its program"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preload()
+
+    def reset(self):
+        super().reset()
+        self.preload()
+
+    def preload(self):
+        # Load by digest every time, as the initial memory may have been patched since the last reset
+        module = load_module(self.initial_memory)
+        self.memory.blocks = dict(module.BLOCKS)
+        self.memory.code = {cell: list(starts) for cell, starts in module.CODE.items()}
+
+
+def check_corrupt_cache(program: Iterable[int]):
+    """Check that a corrupt module in the cache is regenerated instead of failing the run"""
+    global CACHE_DIR
+    import tempfile
+    digest = program_digest(program)
+    cache_dir = CACHE_DIR
+    with tempfile.TemporaryDirectory() as temp_dir:
+        CACHE_DIR = temp_dir
+        try:
+            with open(module_path(digest), 'w') as f:
+                f.write("def block_0(vm:\n")
+            _modules.pop(digest, None)
+            module = load_module(program)
+            with open(module_path(digest)) as f:
+                source = f.read()
+        finally:
+            _modules.pop(digest, None)
+            CACHE_DIR = cache_dir
+    if module.VERSION != VERSION or source != generate_module(program):
+        raise AssertionError("A corrupt cached module was not regenerated")
+    print("Corrupt cached module regenerated")
+
+
+def main(args):
+    if not args:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    program = load_program(args[0])
+    if "--check" in args:
+        check_corrupt_cache(program)
+    module = load_module(program)
+    print("{} blocks covering {} cells, in {}".format(len(module.BLOCKS), len(module.CODE),
+                                                      os.path.normpath(module_path(program_digest(program)))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+"""
+Lockstep executor for many independent runs of one program. Every run (a lane) has its own memory, relative base
+and I/O, but lanes that are at the same address are executed together: the instruction is decoded once for the
+whole group, operands are gathered from all lanes into a list, the result is computed for the group and scattered
+back. Lanes split into separate groups when a jump sends them different ways, and merge again when one group
+jumps to an address where another group is waiting.
+
+Instructions are decoded once from the program image, shared by all lanes. Once any lane writes to a cell that is,
+or later turns out to be, part of an instruction, that instruction is decoded from the memory of every lane that
+reaches it, and the lanes are grouped by what they find there. Lanes that find an invalid instruction leave the
+batch and finish on their own in the regular interpreter.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from intcode.compiler import NARGS, VALID_MODES
+from intcode.memory import Memory
+from intcode.vm import (
+    VirtualMachine, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_OUT, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_REB, INSTR_END,
+    MODE_POS, MODE_REL,
+)
+
+Instruction = Tuple[int, Tuple[int, int, int], Tuple[int, ...]]
+
+
+def gather(group: List[VirtualMachine], mode, param) -> List[int]:
+    if mode == MODE_POS:
+        return [vm.memory[param] for vm in group]
+    elif mode == MODE_REL:
+        return [vm.memory[vm.relative_base + param] for vm in group]
+    return [param] * len(group)
+
+
+class BatchVirtualMachine:
+    def __init__(self, program: Iterable[int]):
+        self.base = VirtualMachine(program)
+        self.image = Memory.of(self.base.initial_memory)
+        self.instructions: Dict[int, Optional[Instruction]] = {}
+        # Cell -> addresses of the decoded instructions it is part of
+        self.code: Dict[int, List[int]] = {}
+        # Every cell any lane has written to
+        self.written = set()
+
+    def decode(self, pc) -> Optional[Instruction]:
+        """Decode the instruction at pc from the image, or None if it has to be interpreted per lane"""
+        opcode, modes = decode(self.image[pc])
+        if opcode == INSTR_END:
+            narg = 0
+        elif opcode in NARGS and all(mode in VALID_MODES for mode in modes):
+            narg = NARGS[opcode]
+        else:
+            return None
+        cells = range(pc, pc + 1 + narg)
+        if any(cell in self.written for cell in cells):
+            return None
+        for cell in cells:
+            self.code.setdefault(cell, []).append(pc)
+        return opcode, modes, tuple(self.image[cell] for cell in cells[1:])
+
+    def scatter(self, group: List[VirtualMachine], mode, param, values: List[int]):
+        if mode == MODE_REL:
+            addresses = [vm.relative_base + param for vm in group]
+            for vm, address, value in zip(group, addresses, values):
+                vm.memory[address] = value
+        else:
+            addresses = (param,)
+            for vm, value in zip(group, values):
+                vm.memory[param] = value
+        self.written.update(addresses)
+        for address in self.code.keys() & set(addresses):
+            for pc in self.code.pop(address):
+                self.instructions.pop(pc, None)
+
+    def run(self, inputs: Sequence[Iterable[int]]) -> List[List[int]]:
+        """
+        Run one lane per entry in inputs until all of them halt. Returns the outputs of every lane, in the same order.
+        Like run_until(stop_on_input=False), a lane that runs out of input is an error.
+        """
+        lanes = []
+        for lane_input in inputs:
+            vm = self.base.fork()
+            vm.input_queue.extend(lane_input)
+            lanes.append(vm)
+
+        # Address -> lanes waiting to continue there
+        pending = {self.base.pc: list(lanes)} if lanes else {}
+        while pending:
+            pc = min(pending)
+            self.run_group(pc, pending.pop(pc), pending)
+        return [vm.output_queue.drain() for vm in lanes]
+
+    def run_group(self, pc, group: List[VirtualMachine], pending: Dict[int, List[VirtualMachine]]):
+        """Run a group of lanes at pc together until they halt, split up or run into another group"""
+        instructions = self.instructions
+        while True:
+            try:
+                instruction = instructions[pc]
+            except KeyError:
+                instruction = instructions[pc] = self.decode(pc)
+            if instruction is None:
+                # Lanes have written to this instruction, decode it from the memory of every lane instead
+                for instruction, lanes in self.decode_lanes(pc, group).items():
+                    if instruction is None:
+                        for vm in lanes:
+                            self.detach(vm, pc)
+                    else:
+                        lanes_pc = self.execute(pc, instruction, lanes, pending)
+                        if lanes_pc is not None:
+                            pending.setdefault(lanes_pc, []).extend(lanes)
+                return
+
+            pc = self.execute(pc, instruction, group, pending)
+            if pc is None:
+                return
+            if pc in pending:
+                # Caught up with another group
+                pending[pc].extend(group)
+                return
+
+    @staticmethod
+    def decode_lanes(pc, group: List[VirtualMachine]) -> Dict[Optional[Instruction], List[VirtualMachine]]:
+        """Group lanes by the instruction at pc in their own memory"""
+        lanes = {}
+        for vm in group:
+            opcode, modes = decode(vm.memory[pc])
+            if opcode == INSTR_END:
+                instruction = opcode, modes, ()
+            elif opcode in NARGS and all(mode in VALID_MODES for mode in modes):
+                instruction = opcode, modes, tuple(vm.memory[cell] for cell in range(pc + 1, pc + 1 + NARGS[opcode]))
+            else:
+                instruction = None
+            lanes.setdefault(instruction, []).append(vm)
+        return lanes
+
+    def execute(self, pc, instruction: Instruction, group: List[VirtualMachine],
+                pending: Dict[int, List[VirtualMachine]]) -> Optional[int]:
+        """
+        Execute one instruction on a group of lanes. Returns the address the group continues at, or None if the
+        lanes halted or went different ways (and were added to pending).
+        """
+        opcode, modes, params = instruction
+        if opcode in (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ):
+            xs = gather(group, modes[0], params[0])
+            ys = gather(group, modes[1], params[1])
+            if opcode == INSTR_ADD:
+                values = [x + y for x, y in zip(xs, ys)]
+            elif opcode == INSTR_MUL:
+                values = [x * y for x, y in zip(xs, ys)]
+            elif opcode == INSTR_LT:
+                values = [1 if x < y else 0 for x, y in zip(xs, ys)]
+            else:
+                values = [1 if x == y else 0 for x, y in zip(xs, ys)]
+            self.scatter(group, modes[2], params[2], values)
+            return pc + 4
+        elif opcode == INSTR_INP:
+            try:
+                values = [vm.input_queue.get() for vm in group]
+            except IndexError:
+                raise RuntimeError("Lane blocked on input at {} while all input was expected to be provided".format(pc))
+            self.scatter(group, modes[0], params[0], values)
+            return pc + 2
+        elif opcode == INSTR_OUT:
+            for vm, value in zip(group, gather(group, modes[0], params[0])):
+                vm.output_queue.put(value)
+            return pc + 2
+        elif opcode in (INSTR_JIT, INSTR_JIF):
+            xs = gather(group, modes[0], params[0])
+            targets = gather(group, modes[1], params[1])
+            if opcode == INSTR_JIT:
+                pcs = [target if x != 0 else pc + 3 for x, target in zip(xs, targets)]
+            else:
+                pcs = [target if x == 0 else pc + 3 for x, target in zip(xs, targets)]
+            if pcs.count(pcs[0]) == len(pcs):
+                return pcs[0]
+            # Lanes diverge
+            for vm, lane_pc in zip(group, pcs):
+                pending.setdefault(lane_pc, []).append(vm)
+            return None
+        elif opcode == INSTR_REB:
+            for vm, value in zip(group, gather(group, modes[0], params[0])):
+                vm.relative_base += value
+            return pc + 2
+        # INSTR_END
+        for vm in group:
+            vm.pc = pc
+        return None
+
+    @staticmethod
+    def detach(vm: VirtualMachine, pc):
+        """Finish a lane on its own in the interpreter"""
+        vm.pc = pc
+        _, outputs = vm.run_until(stop_on_input=False)
+        vm.output_queue.extend(outputs)
@@ -0,0 +1,302 @@
+"""
+Micro-benchmark for the Intcode engines. Runs a set of real puzzle workloads from inputs/ on every engine,
+checks that all engines agree on the outputs and prints the best wall-clock time of each.
+
+With --parallel, times the day 7 feedback loop phase search on a growing number of worker processes instead.
+With --network, times both parts of the day 23 network on the original round-robin polling loop and on the
+scheduler, with VMs sleeping only when they are found spinning and after several numbers of idle reads.
+With --arcade, times the headless day 13 game loop in frames per second, finding the paddle and ball in the tile
+index of the day 13 driver and, as it used to, by scanning the whole screen every frame.
+
+Usage: python -m intcode.bench [repeats] [workload ...]
+       python -m intcode.bench --parallel [repeats]
+       python -m intcode.bench --network [repeats]
+       python -m intcode.bench --arcade [repeats]
+"""
+import asyncio
+import os
+import sys
+import time
+from functools import partial
+from itertools import permutations
+from queue import Queue
+
+from intcode import legacy
+from intcode.compiler import CompiledVirtualMachine
+from intcode.fusion import FusedVirtualMachine
+from intcode.loader import read_program
+from intcode.memory import Page, make_image
+from intcode.parallel import parallel_max
+from intcode.scheduler import Scheduler
+from intcode.vm import VirtualMachine
+
+INPUTS_DIR = os.path.join(os.path.dirname(__file__), "../inputs")
+
+
+def ascii_input(*lines):
+    return [ord(c) for c in "".join(line + "\n" for line in lines)]
+
+
+WORKLOADS = [
+    # (name, day, inputs, memory patches)
+    ("day5-diagnostics", 5, [5], {}),
+    ("day9-boost-test", 9, [1], {}),
+    ("day9-boost", 9, [2], {}),
+    ("day13-arcade-draw", 13, [], {}),
+    ("day17-camera", 17, [], {}),
+    ("day19-probe", 19, [10, 10], {}),
+    ("day21-walk", 21, ascii_input("NOT A J", "NOT B T", "OR T J", "NOT C T", "OR T J", "AND D J", "WALK"), {}),
+    ("day25-explore", 25, ascii_input("south", "south", "take hypercube", "north", "north", "north", "take tambourine",
+                                      "east", "take astrolabe", "south", "take shell", "north", "east", "north",
+                                      "take klein bottle", "north", "take easter egg", "south", "south", "west",
+                                      "west", "south", "west", "take dark matter", "west", "north", "west",
+                                      "take coin", "south"), {}),
+]
+
+
+def load_program(day_number) -> Page:
+    return read_program(os.path.join(INPUTS_DIR, "day{}_input".format(day_number)))
+
+
+def legacy_vm(program):
+    vm = legacy.VirtualMachine()
+    vm.memory = legacy.defaultlist(lambda: 0)
+    vm.memory.extend(program)
+    vm.input_queue = Queue()
+    vm.output_queue = Queue()
+    return vm
+
+
+def run_stepping(vm, inputs):
+    for i in inputs:
+        vm.input_queue.put(i)
+    while not vm.run_instruction():
+        if vm.waiting and vm.input_queue.empty():
+            break
+    outputs = []
+    while not vm.output_queue.empty():
+        outputs.append(vm.output_queue.get())
+    return outputs
+
+
+def run_until(vm, inputs):
+    vm.input_queue.extend(inputs)
+    return vm.run_until()[1]
+
+
+ENGINES = {
+    # name: (vm factory, runner)
+    "legacy": (legacy_vm, run_stepping),
+    "intcode": (VirtualMachine, run_stepping),
+    "run_until": (VirtualMachine, run_until),
+    "fused": (FusedVirtualMachine, run_until),
+    "compiled": (CompiledVirtualMachine, run_until),
+}
+
+
+def bench_workload(program, inputs, patches, engine, repeats):
+    factory, runner = engine
+    best, outputs = None, None
+    for _ in range(repeats):
+        vm = factory(program)
+        for addr, value in patches.items():
+            vm.memory[addr] = value
+        start_time = time.perf_counter()
+        outputs = runner(vm, inputs)
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, outputs
+
+
+def bench_parallel(repeats):
+    from days.day7 import amplify
+
+    search = partial(amplify, make_image(load_program(7)), feedback=True)
+    print("{:<10}{:>14}{:>10}".format("workers", "day7-search", "speedup"))
+    baseline = None
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        best, result = None, None
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            result = parallel_max(search, permutations(range(5, 10)), workers)
+            elapsed = time.perf_counter() - start_time
+            if best is None or elapsed < best:
+                best = elapsed
+        if baseline is None:
+            baseline = best, result
+        elif result != baseline[1]:
+            raise AssertionError("{} workers disagree with 1 worker".format(workers))
+        print("{:<10}{:>12.2f}ms{:>9.1f}x".format(workers, best * 1000, baseline[0] / best))
+
+
+def poll_network(program, part):
+    """The day 23 network as it used to run: every VM one instruction per tick, idle VMs are fed -1"""
+    vms = [VirtualMachine(program) for _ in range(50)]
+    for address, vm in enumerate(vms):
+        vm.input_queue.put(address)
+    packet_queues = [[] for _ in vms]
+    output_buffers = [[] for _ in vms]
+    recv_states = [False for _ in vms]
+    nat, nat_history = None, []
+    while True:
+        for i, vm in enumerate(vms):
+            vm.run_instruction()
+            if not vm.output_queue.empty():
+                output_buffers[i].append(vm.output_queue.get())
+                if len(output_buffers[i]) == 3:
+                    dest_addr, x_val, y_val = output_buffers[i]
+                    output_buffers[i] = []
+                    if dest_addr == 255:
+                        if part == 1:
+                            return y_val
+                        nat = x_val, y_val
+                    else:
+                        packet_queues[dest_addr].append((x_val, y_val))
+            if vm.waiting:
+                if not packet_queues[i]:
+                    vm.input_queue.put(-1)
+                    recv_states[i] = True
+                else:
+                    vm.input_queue.extend(packet_queues[i].pop(0))
+                    recv_states[i] = False
+        if nat is not None and all(recv_states) and not any(packet_queues):
+            packet_queues[0].append(nat)
+            if nat[1] in nat_history:
+                return nat[1]
+            nat_history.append(nat[1])
+
+
+def schedule_network(program, part, idle_reads):
+    vms = [VirtualMachine(program) for _ in range(50)]
+    for address, vm in enumerate(vms):
+        vm.input_queue.put(address)
+    nat, nat_history = [], set()
+
+    def route(source, packet):
+        dest_addr, x_val, y_val = packet
+        if dest_addr != 255:
+            scheduler.send(dest_addr, [x_val, y_val])
+        elif part == 1:
+            scheduler.stop(y_val)
+        else:
+            nat[:] = [x_val, y_val]
+
+    def on_idle():
+        if nat:
+            scheduler.send(0, list(nat))
+            if nat[1] in nat_history:
+                scheduler.stop(nat[1])
+            nat_history.add(nat[1])
+
+    scheduler = Scheduler(vms, route, on_idle, idle_reads=idle_reads)
+    return asyncio.run(scheduler.run())
+
+
+def bench_network(repeats):
+    program = make_image(load_program(23))
+    engines = [("polling", poll_network), ("spin-detect", partial(schedule_network, idle_reads=None))] + [
+        ("sleep-after-{}".format(k), partial(schedule_network, idle_reads=k)) for k in (1, 2, 4)]
+    print("{:<10}".format("part") + "".join("{:>16}".format(name) for name, _ in engines) + "{:>10}".format("speedup"))
+    for part in (1, 2):
+        timings, reference = [], None
+        for name, engine in engines:
+            best, result = None, None
+            for _ in range(repeats):
+                start_time = time.perf_counter()
+                result = engine(program, part)
+                elapsed = time.perf_counter() - start_time
+                if best is None or elapsed < best:
+                    best = elapsed
+            if reference is None:
+                reference = result
+            elif result != reference:
+                raise AssertionError("part {}: {} disagrees with polling".format(part, name))
+            timings.append(best)
+        print("{:<10}".format(part) + "".join("{:>14.2f}ms".format(t * 1000) for t in timings) +
+              "{:>9.1f}x".format(timings[0] / min(timings[1:])))
+
+
+def bench_arcade(repeats):
+    from days.day13 import Day13, PADDLE, BALL
+
+    class ScanningDay13(Day13):
+        """The day 13 driver as it used to find tiles, scanning every position on the screen"""
+        def draw(self, output):
+            for screen_x, screen_y, tile_type in zip(*[iter(output)] * 3):
+                if screen_x == -1 and screen_y == 0:
+                    self.score = tile_type
+                else:
+                    self.screen[(screen_y, screen_x)] = tile_type
+
+        @property
+        def paddle_x(self):
+            p = [x for y, x in self.screen.keys() if self.screen[(y, x)] == PADDLE]
+            return p[0] if p else None
+
+        @property
+        def ball_x(self):
+            p = [x for y, x in self.screen.keys() if self.screen[(y, x)] == BALL]
+            return p[0] if p else None
+
+    with open(os.path.join(INPUTS_DIR, "day13_input")) as f:
+        input_data = f.read().strip()
+    print("{:<10}{:>10}{:>14}{:>14}".format("driver", "frames", "time", "frames/s"))
+    reference = None
+    for name, cls in (("scanning", ScanningDay13), ("indexed", Day13)):
+        best, frames, score = None, 0, None
+        for _ in range(repeats):
+            day = cls(2019, 13, "")
+            day.common(input_data)
+            vm = day.virtual_machines[0]
+            vm.memory[0] = 2
+            start_time = time.perf_counter()
+            frames = day.play(vm)
+            elapsed = time.perf_counter() - start_time
+            if best is None or elapsed < best:
+                best = elapsed
+            score = day.score
+        if reference is None:
+            reference = score
+        elif score != reference:
+            raise AssertionError("{} driver ends with score {} instead of {}".format(name, score, reference))
+        print("{:<10}{:>10}{:>12.2f}ms{:>14.0f}".format(name, frames, best * 1000, frames / best))
+
+
+def main(args):
+    parallel = "--parallel" in args
+    network = "--network" in args
+    arcade = "--arcade" in args
+    args = [arg for arg in args if arg not in ("--parallel", "--network", "--arcade")]
+    repeats = 3
+    if args and args[0].isdigit():
+        repeats = int(args[0])
+        args = args[1:]
+    if parallel:
+        bench_parallel(repeats)
+        return
+    if network:
+        bench_network(repeats)
+        return
+    if arcade:
+        bench_arcade(repeats)
+        return
+    workloads = [w for w in WORKLOADS if not args or w[0] in args]
+
+    print("{:<20}".format("workload") + "".join("{:>14}".format(name) for name in ENGINES) + "{:>10}".format("speedup"))
+    for name, day_number, inputs, patches in workloads:
+        program = load_program(day_number)
+        timings, reference = [], None
+        for engine_name, engine in ENGINES.items():
+            elapsed, outputs = bench_workload(program, inputs, patches, engine, repeats)
+            if reference is None:
+                reference = outputs
+            elif outputs != reference:
+                raise AssertionError("{}: engine {} disagrees with {}".format(name, engine_name, next(iter(ENGINES))))
+            timings.append(elapsed)
+        print("{:<20}".format(name) + "".join("{:>12.2f}ms".format(t * 1000) for t in timings) +
+              "{:>9.1f}x".format(timings[0] / min(timings[1:])))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+"""
+Result cache for pure Intcode runs: running a program from its initial state on a fixed input sequence until it halts
+always gives the same outputs, so those can be looked up instead of computed. Entries are keyed by a digest of the
+program image and the input sequence, and kept in memory with LRU eviction. Optionally they are also stored in a
+SQLite database, so they survive between runs.
+
+Only use it for runs that start from a freshly reset VM and get all their input up front.
+"""
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from intcode.memory import make_image
+from intcode.vm import VirtualMachine
+from intcode.watchdog import Watchdog
+
+Key = Tuple[str, Tuple[int, ...]]
+
+
+def program_digest(program: Iterable[int]) -> str:
+    image = make_image(program)
+    data = image.tobytes() if hasattr(image, "tobytes") else ",".join(map(str, image)).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class RunCache:
+    def __init__(self, maxsize: Optional[int] = 4096, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.entries: 'OrderedDict[Key, Tuple[int, ...]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # id(initial memory) -> (initial memory, digest). The image is kept so its id is not reused.
+        self.digests: Dict[int, Tuple[object, str]] = {}
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS runs "
+                            "(program TEXT, inputs TEXT, outputs TEXT, PRIMARY KEY (program, inputs))")
+
+    def digest(self, vm: VirtualMachine) -> str:
+        image = vm.initial_memory
+        try:
+            return self.digests[id(image)][1]
+        except KeyError:
+            digest = program_digest(image)
+            self.digests[id(image)] = image, digest
+            return digest
+
+    def get(self, key: Key) -> Optional[Tuple[int, ...]]:
+        try:
+            outputs = self.entries[key]
+            self.entries.move_to_end(key)
+        except KeyError:
+            outputs = None
+            if self.db is not None:
+                row = self.db.execute("SELECT outputs FROM runs WHERE program = ? AND inputs = ?",
+                                      (key[0], ",".join(map(str, key[1])))).fetchone()
+                if row is not None:
+                    outputs = tuple(map(int, row[0].split(","))) if row[0] else ()
+                    self.store(key, outputs)
+        if outputs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return outputs
+
+    def put(self, key: Key, outputs: Iterable[int]):
+        outputs = tuple(outputs)
+        self.store(key, outputs)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)",
+                            (key[0], ",".join(map(str, key[1])), ",".join(map(str, outputs))))
+
+    def store(self, key: Key, outputs: Tuple[int, ...]):
+        self.entries[key] = outputs
+        self.entries.move_to_end(key)
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def key(self, vm: VirtualMachine, inputs: Iterable[int]) -> Key:
+        return self.digest(vm), tuple(inputs)
+
+    def run(self, vm: VirtualMachine, inputs: Iterable[int], watchdog: Optional[Watchdog] = None) -> List[int]:
+        """
+        Outputs of resetting vm and running it on inputs until it halts, from the cache if possible. A run that is
+        not cached goes through watchdog, if given, which raises when it goes over its limits.
+        """
+        key = self.key(vm, inputs)
+        outputs = self.get(key)
+        if outputs is None:
+            vm.reset()
+            vm.input_queue.extend(key[1])
+            if watchdog is not None:
+                _, outputs = watchdog.run_until(vm, stop_on_input=False)
+            else:
+                _, outputs = vm.run_until(stop_on_input=False)
+            self.put(key, outputs)
+        return list(outputs)
+
+    def close(self):
+        """Commit new entries to the database and close it"""
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return "Run cache: {} hits, {} misses ({:.1%} hit rate), {} entries".format(
+            self.hits, self.misses, self.hits / total if total else 0, len(self.entries))
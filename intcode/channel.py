@@ -0,0 +1,21 @@
+from collections import deque
+from typing import List
+
+
+class Channel(deque):
+    """
+    FIFO used for VM input and output. Has the put/get/empty interface of queue.Queue, but without the locking,
+    as all VMs are scheduled from a single thread. put and get are plain deque methods, get raises IndexError
+    when the channel is empty instead of blocking.
+    """
+    put = deque.append
+    get = deque.popleft
+
+    def empty(self) -> bool:
+        return not self
+
+    def drain(self) -> List[int]:
+        """Remove and return everything currently in the channel"""
+        items = list(self)
+        self.clear()
+        return items
@@ -0,0 +1,107 @@
+"""
+VM checkpoints on disk, see VirtualMachine.save() and VirtualMachine.load_checkpoint(). A checkpoint holds the pc,
+relative base, pending input and output, and the memory cells that differ from the initial program, so it stays
+small however much memory the program has. It can only be loaded into a VM with the same initial program, which is
+checked by digest.
+
+A header is followed by the info the driver saved with the checkpoint as UTF-8 JSON, and then a sequence of zigzag
+varints, which also fits values that do not fit in 64 bits:
+
+    pc, relative base, waiting, number of inputs, inputs..., number of outputs, outputs...,
+    number of changed cells, (address - previous address, value)...
+
+Caches (decoded instructions, compiled blocks) are not saved; they are rebuilt as the VM runs.
+"""
+import json
+import os
+import struct
+from typing import Iterator, List, Optional
+
+from intcode.cache import program_digest
+from intcode.memory import Memory, ZERO_PAGE, PAGE_BITS
+
+MAGIC = b"ICCK"
+VERSION = 1
+# Magic, format version, SHA-1 of the initial program, length of the info
+HEADER = struct.Struct("<4sB20sI")
+
+
+def encode(values: List[int]) -> bytes:
+    data = bytearray()
+    for value in values:
+        value = value * 2 if value >= 0 else -value * 2 - 1
+        while value > 0x7f:
+            data.append(value & 0x7f | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def decode(data: bytes) -> Iterator[int]:
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield value >> 1 if not value & 1 else -(value >> 1) - 1
+        value = shift = 0
+
+
+def changed_cells(memory: Memory, initial: Memory) -> List[int]:
+    """Address and value of every cell that differs from the initial memory, flattened"""
+    cells = []
+    for number, page in sorted(memory.pages.items()):
+        initial_page = initial.pages.get(number, ZERO_PAGE)
+        if page is initial_page or page == initial_page:
+            continue
+        base = number << PAGE_BITS
+        for offset, (value, initial_value) in enumerate(zip(page, initial_page)):
+            if value != initial_value:
+                cells.extend((base + offset, value))
+    return cells
+
+
+def save(vm, path, info: Optional[dict] = None):
+    cells = changed_cells(vm.memory, Memory.of(vm.initial_memory))
+    # Store addresses as the distance to the previous one
+    previous = 0
+    for i in range(0, len(cells), 2):
+        cells[i], previous = cells[i] - previous, cells[i]
+    info_data = json.dumps(info).encode("utf-8") if info is not None else b""
+    values = [vm.pc, vm.relative_base, int(vm.waiting),
+              len(vm.input_queue), *vm.input_queue, len(vm.output_queue), *vm.output_queue,
+              len(cells) // 2, *cells]
+
+    # Write to a temporary file first, so an interrupted save leaves the previous checkpoint alone
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, bytes.fromhex(program_digest(vm.initial_memory)), len(info_data)))
+        f.write(info_data)
+        f.write(encode(values))
+    os.replace(temp_path, path)
+
+
+def load(vm, path) -> Optional[dict]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, digest, info_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not an Intcode checkpoint of version {}".format(path, VERSION))
+    if digest.hex() != program_digest(vm.initial_memory):
+        raise ValueError("{} was saved from a different program".format(path))
+    info_data = data[HEADER.size:HEADER.size + info_length]
+
+    vm.reset()
+    values = decode(data[HEADER.size + info_length:])
+    vm.pc = next(values)
+    vm.relative_base = next(values)
+    vm.waiting = bool(next(values))
+    vm.input_queue.extend(next(values) for _ in range(next(values)))
+    vm.output_queue.extend(next(values) for _ in range(next(values)))
+    memory = vm.memory
+    address = 0
+    for _ in range(next(values)):
+        address += next(values)
+        memory[address] = next(values)
+    return json.loads(info_data.decode("utf-8")) if info_data else None
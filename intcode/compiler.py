@@ -0,0 +1,233 @@
+"""
+Basic-block compiler for Intcode. Straight-line runs of instructions are translated to Python source with the
+parameter modes resolved and immediates folded, compiled once and then executed as a whole per dispatch.
+
+A block starts at whatever address execution arrives at (a jump target, or the instruction after the end of the
+previous block) and ends at a jump, an output, a halt or an instruction that writes into the rest of the block.
+Cells that the program overwrites after they were compiled become volatile: operands in volatile cells are read
+from memory at run time, and instructions whose opcode cell is volatile are left to the interpreter.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+from intcode.memory import Memory
+from intcode.vm import (
+    VirtualMachine, Status, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_OUT, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_REB,
+    MODE_POS, MODE_IMM, MODE_REL,
+)
+
+MAX_BLOCK_LENGTH = 64
+VALID_MODES = (MODE_POS, MODE_IMM, MODE_REL)
+
+NARGS = {
+    INSTR_ADD: 3, INSTR_MUL: 3, INSTR_INP: 1, INSTR_OUT: 1, INSTR_JIT: 2,
+    INSTR_JIF: 2, INSTR_LT: 3, INSTR_EQ: 3, INSTR_REB: 1,
+}
+
+# Generated source -> compiled block function, shared by every VM running the same code
+_compiled: Dict[str, Callable[[VirtualMachine], bool]] = {}
+
+
+class BlockBuilder:
+    def __init__(self, memory: Memory, start: int):
+        self.memory = memory
+        self.start = start
+        self.lines = []
+        self.cells = []
+        self.written = set()
+        self.uses_rb = False
+        self.writes_rb = False
+        self.dynamic_writes = False
+        # Address after the last instruction in the block, set by generate()
+        self.end = start
+
+    def raw(self, cell):
+        if cell in self.memory.volatile:
+            return "mem[{}]".format(cell)
+        self.cells.append(cell)
+        return str(self.memory[cell])
+
+    def value(self, mode, cell):
+        raw = self.raw(cell)
+        if mode == MODE_POS:
+            return "mem[{}]".format(raw)
+        elif mode == MODE_REL:
+            self.uses_rb = True
+            return "mem[rb + {}]".format(raw)
+        return raw
+
+    def address(self, mode, cell):
+        """Returns the target address expression of a write, and whether it is known at compile time"""
+        raw = self.raw(cell)
+        if mode == MODE_REL:
+            self.uses_rb = True
+            return "rb + {}".format(raw), False
+        return raw, cell not in self.memory.volatile
+
+    def exit(self, indent, pc, result="False", waiting=False):
+        lines = []
+        if self.writes_rb:
+            lines.append("vm.relative_base = rb")
+        if waiting:
+            lines.append("vm.waiting = True")
+        lines.append("vm.pc = {}".format(pc))
+        lines.append("return {}".format(result))
+        self.lines.extend(" " * indent + line for line in lines)
+
+    def write(self, target, expression, next_pc):
+        address, static = target
+        if static:
+            # Code that this write lands in is not compiled into the rest of the block
+            self.written.add(int(address))
+            self.lines.append("    mem[{}] = {}".format(address, expression))
+            return
+        # Only known at run time, leave the block if the write lands in it
+        self.dynamic_writes = True
+        self.lines.append("    a = {}".format(address))
+        self.lines.append("    mem[a] = {}".format(expression))
+        self.lines.append("    if {start} <= a < {end}:")
+        self.exit(8, next_pc)
+
+    def generate(self) -> Optional[str]:
+        """Source of the block function, or None if the instruction at the start has to be interpreted"""
+        memory = self.memory
+        pc = self.start
+        for _ in range(MAX_BLOCK_LENGTH):
+            if pc in memory.volatile:
+                break
+            opcode, modes = decode(memory[pc])
+            if opcode not in NARGS or any(mode not in VALID_MODES for mode in modes):
+                # Halt or an invalid instruction, leave both to the interpreter
+                break
+            next_pc = pc + 1 + NARGS[opcode]
+            if any(cell in self.written for cell in range(pc, next_pc)):
+                break
+            self.cells.append(pc)
+            self.lines.append("    # {}: {}".format(pc, ",".join(str(memory[c]) for c in range(pc, next_pc))))
+
+            if opcode in (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ):
+                x = self.value(modes[0], pc + 1)
+                y = self.value(modes[1], pc + 2)
+                target = self.address(modes[2], pc + 3)
+                if opcode == INSTR_ADD:
+                    expression = "{} + {}".format(x, y)
+                elif opcode == INSTR_MUL:
+                    expression = "{} * {}".format(x, y)
+                elif opcode == INSTR_LT:
+                    expression = "1 if {} < {} else 0".format(x, y)
+                else:
+                    expression = "1 if {} == {} else 0".format(x, y)
+                self.write(target, expression, next_pc)
+                pc = next_pc
+            elif opcode == INSTR_INP:
+                target = self.address(modes[0], pc + 1)
+                self.lines.append("    if not vm.input_queue:")
+                self.exit(8, pc, waiting=True)
+                self.write(target, "vm.input_queue.get()", next_pc)
+                pc = next_pc
+            elif opcode == INSTR_OUT:
+                self.lines.append("    vm.output_queue.put({})".format(self.value(modes[0], pc + 1)))
+                pc = next_pc
+                break
+            elif opcode in (INSTR_JIT, INSTR_JIF):
+                x = self.value(modes[0], pc + 1)
+                target = self.value(modes[1], pc + 2)
+                self.lines.append("    if {} {} 0:".format(x, "!=" if opcode == INSTR_JIT else "=="))
+                self.exit(8, target)
+                pc = next_pc
+                break
+            elif opcode == INSTR_REB:
+                self.lines.append("    rb += {}".format(self.value(modes[0], pc + 1)))
+                self.writes_rb = True
+                self.uses_rb = True
+                pc = next_pc
+
+        self.end = pc
+        if pc == self.start:
+            return None
+
+        self.exit(4, pc)
+        header = ["def block(vm):", "    mem = vm.memory"]
+        if self.uses_rb:
+            header.append("    rb = vm.relative_base")
+        source = "\n".join(header + self.lines)
+        if self.dynamic_writes:
+            source = source.replace("{start}", str(self.start)).replace("{end}", str(pc))
+        return source
+
+    def build(self) -> Optional[Callable[[VirtualMachine], bool]]:
+        source = self.generate()
+        if source is None:
+            return None
+
+        func = _compiled.get(source)
+        if func is None:
+            namespace = {}
+            exec(compile(source, "<intcode block {}>".format(self.start), "exec"), namespace)
+            func = _compiled[source] = namespace["block"]
+
+        for cell in self.cells:
+            self.memory.code.setdefault(cell, []).append(self.start)
+        return func
+
+
+def compile_block(memory: Memory, start: int) -> Optional[Callable[[VirtualMachine], bool]]:
+    """Compile the block starting at start. Returns None if the instruction there has to be interpreted."""
+    return BlockBuilder(memory, start).build()
+
+
+class CompiledVirtualMachine(VirtualMachine):
+    """
+    VirtualMachine that executes a whole compiled block per run_instruction() call. Every block ends at the
+    first output, so drivers still see at most one new output per call.
+
+    In run_until(), max_steps counts dispatches (blocks, or single interpreted instructions) instead of instructions.
+    """
+
+    def run_instruction(self):
+        if self.waiting:
+            if not self.input_queue:
+                return False
+            self.waiting = False
+
+        memory = self.memory
+        blocks = memory.blocks
+        pc = self.pc
+        try:
+            block = blocks[pc]
+        except KeyError:
+            block = blocks[pc] = compile_block(memory, pc)
+        if block is None:
+            return VirtualMachine.run_instruction(self)
+        return block(self)
+
+    def run_until(self, stop_on_input=True, max_outputs: Optional[int] = None,
+                  max_steps: Optional[int] = None) -> Tuple[Status, List[int]]:
+        if self.waiting:
+            if not self.input_queue:
+                return self._stopped(Status.WAITING, stop_on_input)
+            self.waiting = False
+            self.resume()
+
+        memory = self.memory
+        blocks = memory.blocks
+        outputs = self.output_queue
+        output_limit = len(outputs) + max_outputs if max_outputs is not None else -1
+        limit = steps = max_steps if max_steps is not None else -1
+        while steps:
+            pc = self.pc
+            try:
+                block = blocks[pc]
+            except KeyError:
+                block = blocks[pc] = compile_block(memory, pc)
+            if block is None:
+                if VirtualMachine.run_instruction(self):
+                    return self._stopped(Status.HALTED, stop_on_input, limit - steps)
+            else:
+                block(self)
+            if self.waiting:
+                return self._stopped(Status.WAITING, stop_on_input, limit - steps)
+            if len(outputs) == output_limit:
+                return self._stopped(Status.OUTPUT, stop_on_input, limit - steps + 1)
+            steps -= 1
+        return self._stopped(Status.STEPS, stop_on_input, limit - steps)
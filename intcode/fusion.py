@@ -0,0 +1,214 @@
+"""
+Superinstructions for the interpreter. When FusedVirtualMachine decodes an instruction, it looks at the one after
+it, and common pairs are fused into a single handler that runs both:
+
+- compare-branch: lt or eq followed by jit or jif, which is how compiled if and while conditions look
+- add-add: two adds in a row, like updating a loop counter and a pointer
+- rebase-load: reb followed by add, mult, lt or eq, like the function prologue loading its arguments
+
+Fused entries live in the decoded instruction cache with FUSED as their argument count, so the regular dispatch
+loops run them without knowing about fusion: they leave pc alone and call the handler as if it were a
+one-argument instruction. Writing to the opcode of the second instruction of a pair drops the fused entry. When the
+first instruction of a pair rewrites the second one, the handler stops after the first one.
+
+In run_until(), max_steps counts a fused pair as one step.
+
+Set count on a FusedVirtualMachine class to count how often every pattern runs in stats. The counting handlers
+wrap the regular ones, so VMs that do not count pay nothing for it.
+
+Check that fusion gives the same results as the plain interpreter on the puzzle inputs, and how often every
+pattern fires, with: python -m intcode.fusion [workload ...]
+"""
+import sys
+from collections import Counter
+
+from intcode.vm import (
+    VirtualMachine, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_REB,
+    MODE_POS, MODE_IMM, MODE_REL,
+)
+
+FUSED = -1
+
+COMPARE_BRANCH = "compare-branch"
+ADD_ADD = "add-add"
+REBASE_LOAD = "rebase-load"
+
+# Number of times every pattern ran, over all fused VMs with count set
+stats = Counter()
+
+
+def compare_branch(vm: VirtualMachine, data, x):
+    less, mode_x, mode_y, mode_z, jump_if, mode_condition, mode_target, pc2 = data
+    memory = vm.memory
+    rb = vm.relative_base
+    y = memory[pc2 - 2]
+    z = memory[pc2 - 1]
+    if mode_x == MODE_POS:
+        x = memory[x]
+    elif mode_x == MODE_REL:
+        x = memory[rb + x]
+    if mode_y == MODE_POS:
+        y = memory[y]
+    elif mode_y == MODE_REL:
+        y = memory[rb + y]
+    if less:
+        result = 1 if x < y else 0
+    else:
+        result = 1 if x == y else 0
+    if mode_z == MODE_REL:
+        z += rb
+    memory[z] = result
+    if pc2 not in memory.decoded:
+        # The comparison rewrote the branch
+        vm.pc = pc2
+        return False
+
+    condition = memory[pc2 + 1]
+    if mode_condition == MODE_REL:
+        condition += rb
+    if mode_condition == MODE_IMM:
+        pass
+    elif condition == z:
+        # The usual case, branching on the result of the comparison
+        condition = result
+    else:
+        condition = memory[condition]
+    if (condition != 0) == jump_if:
+        target = memory[pc2 + 2]
+        if mode_target == MODE_POS:
+            target = memory[target]
+        elif mode_target == MODE_REL:
+            target = memory[rb + target]
+        vm.pc = target
+    else:
+        vm.pc = pc2 + 3
+    return False
+
+
+def add_add(vm: VirtualMachine, data, x):
+    mode_x, mode_y, mode_z, mode_x2, mode_y2, mode_z2, pc2 = data
+    memory = vm.memory
+    rb = vm.relative_base
+    y = memory[pc2 - 2]
+    z = memory[pc2 - 1]
+    if mode_x == MODE_POS:
+        x = memory[x]
+    elif mode_x == MODE_REL:
+        x = memory[rb + x]
+    if mode_y == MODE_POS:
+        y = memory[y]
+    elif mode_y == MODE_REL:
+        y = memory[rb + y]
+    memory[rb + z if mode_z == MODE_REL else z] = x + y
+    if pc2 not in memory.decoded:
+        vm.pc = pc2
+        return False
+
+    x = memory[pc2 + 1]
+    y = memory[pc2 + 2]
+    z = memory[pc2 + 3]
+    if mode_x2 == MODE_POS:
+        x = memory[x]
+    elif mode_x2 == MODE_REL:
+        x = memory[rb + x]
+    if mode_y2 == MODE_POS:
+        y = memory[y]
+    elif mode_y2 == MODE_REL:
+        y = memory[rb + y]
+    vm.pc = pc2 + 4
+    memory[rb + z if mode_z2 == MODE_REL else z] = x + y
+    return False
+
+
+def rebase_load(vm: VirtualMachine, data, x):
+    mode, instr_func, modes2, pc2 = data
+    memory = vm.memory
+    if mode == MODE_POS:
+        x = memory[x]
+    elif mode == MODE_REL:
+        x = memory[vm.relative_base + x]
+    vm.relative_base += x
+    vm.pc = pc2 + 4
+    instr_func(vm, modes2, memory[pc2 + 1], memory[pc2 + 2], memory[pc2 + 3])
+    return False
+
+
+def counting(handler, pattern):
+    def counted(vm: VirtualMachine, data, x):
+        stats[pattern] += 1
+        return handler(vm, data, x)
+    return counted
+
+
+# Handler -> the same handler counting its runs in stats
+COUNTED = {handler: counting(handler, pattern) for handler, pattern in
+           ((compare_branch, COMPARE_BRANCH), (add_add, ADD_ADD), (rebase_load, REBASE_LOAD))}
+
+COMPARES = {INSTR_LT: True, INSTR_EQ: False}
+BRANCHES = {INSTR_JIT: True, INSTR_JIF: False}
+LOADS = (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ)
+
+
+class FusedVirtualMachine(VirtualMachine):
+    """VirtualMachine that fuses common instruction pairs when decoding. Set fuse to False to decode plainly."""
+    fuse = True
+    # Count the fused pairs that run in stats, for diagnostics
+    count = False
+
+    def decode_instruction(self, pc):
+        first = VirtualMachine.decode_instruction(self, pc)
+        if not self.fuse:
+            return first
+        memory = self.memory
+        opcode, modes = decode(memory[pc])
+        pc2 = pc + 1 + first[2]
+        opcode2, modes2 = decode(memory[pc2])
+        if opcode2 not in self.instr_set:
+            return first
+
+        if opcode in COMPARES and opcode2 in BRANCHES:
+            entry = compare_branch, (COMPARES[opcode], *modes, BRANCHES[opcode2], *modes2[:2], pc2), FUSED
+        elif opcode == INSTR_ADD and opcode2 == INSTR_ADD:
+            entry = add_add, (*modes, *modes2, pc2), FUSED
+        elif opcode == INSTR_REB and opcode2 in LOADS:
+            entry = rebase_load, (modes[0], self.instr_set[opcode2][0], modes2, pc2), FUSED
+        else:
+            return first
+
+        # The second instruction has to be in the cache, so that writing to its opcode drops this entry
+        if pc2 not in memory.decoded:
+            memory.decoded[pc2] = VirtualMachine.decode_instruction(self, pc2)
+        memory.fused[pc2] = pc
+        if self.count:
+            entry = COUNTED[entry[0]], entry[1], FUSED
+        return entry
+
+
+def main(args):
+    from intcode.bench import WORKLOADS, bench_workload, load_program, run_until
+
+    class PlainVirtualMachine(FusedVirtualMachine):
+        fuse = False
+
+    class CountingVirtualMachine(FusedVirtualMachine):
+        count = True
+
+    workloads = [w for w in WORKLOADS if not args or w[0] in args]
+    print("{:<20}{:>14}{:>14}{:>10}".format("workload", "plain", "fused", "speedup"))
+    for name, day_number, inputs, patches in workloads:
+        program = load_program(day_number)
+        plain, reference = bench_workload(program, inputs, patches, (PlainVirtualMachine, run_until), 3)
+        stats.clear()
+        _, outputs = bench_workload(program, inputs, patches, (CountingVirtualMachine, run_until), 1)
+        counts = dict(stats)
+        fused, fused_outputs = bench_workload(program, inputs, patches, (FusedVirtualMachine, run_until), 3)
+        if outputs != reference or fused_outputs != reference:
+            raise AssertionError("{}: fused outputs differ from the plain interpreter".format(name))
+        print("{:<20}{:>12.2f}ms{:>12.2f}ms{:>9.1f}x  {}".format(
+            name, plain * 1000, fused * 1000, plain / fused,
+            ", ".join("{} {}".format(pattern, count) for pattern, count in sorted(counts.items()))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,179 @@
+"""
+Debugging hooks for a VM: breakpoints on program counters, watchpoints on memory cells, and callbacks for every
+input, output or instruction. They replace the module-level DEBUG flag the dispatch loop used to check on every
+instruction.
+
+Like profiling and tracing, hooks work by swapping the class of the VM (see intcode.instrument). The swap happens
+when the first hook is registered, and is undone when the last one is removed. A VM without hooks runs the regular
+dispatch loops, which contain no checks for them.
+
+Callbacks get the VM as their first argument:
+
+- breakpoint: callback(vm), before the instruction at the address runs
+- watchpoint: callback(vm, address, old, new), after an instruction changed the cell
+- input: callback(vm, value), after an instruction read value
+- output: callback(vm, value), after an instruction wrote value to the output channel
+- step: callback(vm), before every instruction. Asking to pause pauses after the instruction
+
+A callback that returns True pauses the VM: run_until() returns Status.BREAKPOINT, and the next call continues
+where it stopped. A breakpoint without a callback always pauses. Print every instruction as it runs, like DEBUG
+used to do, with: Hooks.of(vm).add_step_callback(print_instruction)
+
+Forks of a VM share its hooks.
+"""
+from typing import Callable, Dict, List, Optional
+
+from intcode.instrument import InstrumentedVirtualMachine, instrumented
+from intcode.vm import VirtualMachine, Status
+
+Callback = Callable[..., Optional[bool]]
+
+
+def print_instruction(vm: VirtualMachine):
+    print(vm.disassemble(vm.pc))
+
+
+class Hooks:
+    def __init__(self, vm: VirtualMachine):
+        self.vm = vm
+        # Class of the VM without hooks
+        self.base: type = type(vm)
+        self.breakpoints: Dict[int, List[Optional[Callback]]] = {}
+        self.watchpoints: Dict[int, List[Callback]] = {}
+        self.input_callbacks: List[Callback] = []
+        self.output_callbacks: List[Callback] = []
+        self.step_callbacks: List[Callback] = []
+        # Set when a callback asked to pause during the current instruction
+        self.paused = False
+        # Breakpoint the VM paused on, which should not fire again when it continues
+        self.paused_at: Optional[int] = None
+
+    @classmethod
+    def of(cls, vm: VirtualMachine) -> 'Hooks':
+        """The hooks of vm, created if it has none yet"""
+        hooks = getattr(vm, "hooks", None)
+        if hooks is None:
+            hooks = vm.hooks = cls(vm)
+        return hooks
+
+    def __bool__(self):
+        return bool(self.breakpoints or self.watchpoints or self.input_callbacks or self.output_callbacks or
+                    self.step_callbacks)
+
+    def update(self):
+        """Swap the hooked dispatch loops in or out, depending on whether there are any hooks"""
+        vm = self.vm
+        hooked = instrumented(self.base, HookedVirtualMachine)
+        if self and type(vm) is self.base:
+            vm.__class__ = hooked
+        elif not self and type(vm) is hooked:
+            vm.__class__ = self.base
+
+    def add_breakpoint(self, pc: int, callback: Optional[Callback] = None):
+        self.breakpoints.setdefault(pc, []).append(callback)
+        self.update()
+
+    def remove_breakpoint(self, pc: int):
+        self.breakpoints.pop(pc, None)
+        self.update()
+
+    def add_watchpoint(self, address: int, callback: Callback):
+        self.watchpoints.setdefault(address, []).append(callback)
+        self.update()
+
+    def remove_watchpoint(self, address: int):
+        self.watchpoints.pop(address, None)
+        self.update()
+
+    def add_input_callback(self, callback: Callback):
+        self.input_callbacks.append(callback)
+        self.update()
+
+    def add_output_callback(self, callback: Callback):
+        self.output_callbacks.append(callback)
+        self.update()
+
+    def add_step_callback(self, callback: Callback):
+        self.step_callbacks.append(callback)
+        self.update()
+
+    def clear(self):
+        """Remove all hooks"""
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self.input_callbacks.clear()
+        self.output_callbacks.clear()
+        self.step_callbacks.clear()
+        self.paused = False
+        self.paused_at = None
+        self.update()
+
+    def call(self, vm: VirtualMachine, callbacks: List[Callback], *args):
+        # Call all of them, also when an earlier one already asked to pause
+        for callback in callbacks:
+            if callback(vm, *args):
+                self.paused = True
+
+
+class HookedVirtualMachine(InstrumentedVirtualMachine):
+    """Dispatch loops calling the hooks, mixed in front of the class of a VM by Hooks.update()"""
+    hooks: Hooks = None
+
+    def step(self) -> bool:
+        hooks = self.hooks
+        memory = self.memory
+        pc = self.pc
+        hooks.paused = False
+        if pc in hooks.breakpoints and hooks.paused_at != pc:
+            for callback in hooks.breakpoints[pc]:
+                if callback is None or callback(self):
+                    hooks.paused = True
+            if hooks.paused:
+                hooks.paused_at = pc
+                return False
+        # Step callbacks that ask to pause do so after the instruction, so continuing does not ask again
+        if hooks.step_callbacks:
+            hooks.call(self, hooks.step_callbacks)
+
+        watched = [(address, memory[address]) for address in hooks.watchpoints]
+        inputs = len(self.input_queue)
+        next_input = self.input_queue[0] if inputs else None
+        outputs = len(self.output_queue)
+        halted = super().step()
+        if self.waiting:
+            return halted
+        hooks.paused_at = None
+
+        if hooks.input_callbacks and len(self.input_queue) < inputs:
+            hooks.call(self, hooks.input_callbacks, next_input)
+        if hooks.output_callbacks and len(self.output_queue) > outputs:
+            hooks.call(self, hooks.output_callbacks, self.output_queue[-1])
+        for address, old in watched:
+            new = memory[address]
+            if new != old:
+                hooks.call(self, hooks.watchpoints[address], address, old, new)
+        return halted
+
+    def run_until(self, stop_on_input=True, max_outputs=None, max_steps=None):
+        if self.waiting:
+            if not self.input_queue:
+                return self._stopped(Status.WAITING, stop_on_input)
+            self.resume()
+
+        hooks = self.hooks
+        outputs = self.output_queue
+        output_limit = len(outputs) + max_outputs if max_outputs is not None else -1
+        limit = steps = max_steps if max_steps is not None else -1
+        while steps:
+            if self.step():
+                return self._stopped(Status.HALTED, stop_on_input, limit - steps)
+            if hooks.paused:
+                # A breakpoint pauses before its instruction, other hooks after theirs
+                ran = 0 if hooks.paused_at == self.pc else 1
+                return self._stopped(Status.BREAKPOINT, stop_on_input, limit - steps + ran)
+            if self.waiting:
+                return self._stopped(Status.WAITING, stop_on_input, limit - steps)
+            if len(outputs) == output_limit:
+                return self._stopped(Status.OUTPUT, stop_on_input, limit - steps + 1)
+            steps -= 1
+        return self._stopped(Status.STEPS, stop_on_input, limit - steps)
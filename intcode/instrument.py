@@ -0,0 +1,91 @@
+"""
+Support for instrumented VMs. Instrumentation (profiling, tracing) is attached to a VM by swapping its class for a
+subclass with an instrumented mixin in front of it, so the regular dispatch loops never check whether it is enabled.
+Instrumented VMs run on the plain interpreter, one instruction at a time, also when they are compiled VMs.
+
+Mixins can be stacked, as every step() runs the instruction through super().step(). Check that profiling, tracing
+and hooks all see every instruction when they are attached to the same VM with: python -m intcode.instrument [day]
+"""
+import sys
+from typing import Dict, Tuple
+
+from intcode.vm import VirtualMachine, Status
+
+_instrumented: Dict[Tuple[type, type], type] = {}
+
+
+def instrumented(cls: type, mixin: type) -> type:
+    """Subclass of the VM class cls with mixin in front of it"""
+    if issubclass(cls, mixin):
+        return cls
+    if (cls, mixin) not in _instrumented:
+        name = mixin.__name__.replace("VirtualMachine", cls.__name__)
+        _instrumented[cls, mixin] = type(name, (mixin, cls), {})
+    return _instrumented[cls, mixin]
+
+
+class InstrumentedVirtualMachine(VirtualMachine):
+    """
+    Dispatch loops in terms of step(), which subclasses override to observe every instruction. resume() is called
+    when a VM that was blocked on input continues.
+    """
+
+    def step(self) -> bool:
+        """Run one instruction on the plain interpreter. Returns True once the program has halted."""
+        return VirtualMachine.run_instruction(self)
+
+    def run_instruction(self):
+        if self.waiting:
+            if not self.input_queue:
+                return False
+            self.resume()
+        return self.step()
+
+    def run_until(self, stop_on_input=True, max_outputs=None, max_steps=None):
+        if self.waiting:
+            if not self.input_queue:
+                return self._stopped(Status.WAITING, stop_on_input)
+            self.resume()
+
+        outputs = self.output_queue
+        output_limit = len(outputs) + max_outputs if max_outputs is not None else -1
+        limit = steps = max_steps if max_steps is not None else -1
+        while steps:
+            if self.step():
+                return self._stopped(Status.HALTED, stop_on_input, limit - steps)
+            if self.waiting:
+                return self._stopped(Status.WAITING, stop_on_input, limit - steps)
+            if len(outputs) == output_limit:
+                return self._stopped(Status.OUTPUT, stop_on_input, limit - steps + 1)
+            steps -= 1
+        return self._stopped(Status.STEPS, stop_on_input, limit - steps)
+
+
+def main(args):
+    from intcode.analysis import load_program
+    from intcode.hooks import Hooks
+    from intcode.profiler import Profiler
+    from intcode.trace import TraceBuffer
+
+    program = load_program(args[0] if args else "9")
+    vm = VirtualMachine(program)
+    profiler = Profiler()
+    profiler.attach(vm)
+    trace = TraceBuffer()
+    trace.attach(vm)
+    steps = []
+    Hooks.of(vm).add_step_callback(lambda vm: steps.append(vm.pc))
+    # Day 9 runs its self-test with input 1, other programs get no input
+    vm.input_queue.put(1)
+    status, _ = vm.run_until()
+    print("{}: {} ran {}".format(type(vm).__name__, status.value, profiler.instructions))
+    # The trace and hooks also see the halt instruction, which the profiler does not count
+    halt = 1 if status == Status.HALTED else 0
+    counts = {"profiler": profiler.instructions + halt, "trace": trace.count, "hooks": len(steps)}
+    if len(set(counts.values())) != 1 or not profiler.instructions:
+        raise AssertionError("Stacked instrumentation disagrees: {}".format(counts))
+    print("Profiler, trace and hooks all saw {} instructions".format(profiler.instructions))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,28 @@
+"""
+Program loading. A program is parsed in one pass into a packed image of 64-bit cells (see make_image), which VMs
+share instead of each keeping their own copy: a VM never writes to its initial memory, only to the copy-on-write
+pages of its own Memory. Days that patch a program before running it should patch a copy and load() that.
+"""
+import json
+from array import array
+from typing import Union
+
+from intcode.memory import Page
+
+
+def parse_program(text: Union[str, bytes]) -> Page:
+    """Parse comma-separated integers into an image, or a plain list if a value does not fit in 64 bits"""
+    if isinstance(text, bytes):
+        text = text.decode("ascii")
+    # The JSON parser is the fastest way to turn the whole text into ints in one go
+    cells = json.loads("[" + text + "]")
+    try:
+        return array('q', cells)
+    except OverflowError:
+        return cells
+
+
+def read_program(path) -> Page:
+    """Read and parse a program file with a single read"""
+    with open(path, 'rb') as f:
+        return parse_program(f.read())
@@ -0,0 +1,151 @@
+from array import array
+from typing import Dict, Iterable, List, Tuple, Union
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+ZERO_PAGE = array('q', bytes(8 * PAGE_SIZE))
+
+Page = Union[array, List[int]]
+
+# Number of images Memory.of() keeps a base Memory for
+MAX_IMAGES = 64
+
+
+def make_image(program: Iterable[int]) -> Page:
+    """
+    Pack a program into an array of 64-bit cells, or a plain list if a value does not fit in 64 bits. Images are
+    never written to, so one that is already an array is shared instead of copied.
+    """
+    if isinstance(program, array) and program.typecode == 'q':
+        return program
+    program = list(program)
+    try:
+        return array('q', program)
+    except OverflowError:
+        return program
+
+
+class Memory:
+    """
+    Intcode memory, split into pages of PAGE_SIZE 64-bit cells that are only allocated once they are written to.
+    Unwritten cells read as 0. A page that is given a value that does not fit in 64 bits is turned into a plain list.
+
+    Also holds a cache of decoded instructions, keyed by the address of their opcode. Writing to a cached opcode cell
+    drops its entry, so self-modifying programs are decoded again. An entry can be a fused pair of instructions (see
+    intcode.fusion), which is also dropped when the opcode of the second instruction is written to.
+
+    Compiled blocks (see intcode.compiler) are cached here as well. Writing a new value to a cell that a block
+    was compiled from drops the block and marks the cell as volatile, so it is never folded into a block again.
+
+    copy() shares all pages between the original and the copy. Pages are only copied once either side writes to them;
+    pages in writable are owned by this Memory, all others may be shared. Memory.of() gives every VM of the same image
+    a copy of one base Memory, so they share its pages until they write to them.
+    """
+    # id(image) -> (image, base Memory of it), holding on to the image so its id is not reused
+    _bases: Dict[int, Tuple[Page, 'Memory']] = {}
+
+    def __init__(self, image: Page = ()):
+        self.pages: Dict[int, Page] = {}
+        for number, offset in enumerate(range(0, len(image), PAGE_SIZE)):
+            page = image[offset:offset + PAGE_SIZE]
+            if len(page) < PAGE_SIZE:
+                page.extend(ZERO_PAGE[len(page):] if isinstance(page, array) else [0] * (PAGE_SIZE - len(page)))
+            self.pages[number] = page
+        self.writable: Dict[int, Page] = dict(self.pages)
+
+        self.decoded = {}
+        # Opcode cell of the second instruction of a fused pair -> address of the pair
+        self.fused = {}
+        # Start address -> compiled block, or None if the instruction there has to be interpreted
+        self.blocks = {}
+        # Cell -> start addresses of the blocks that were compiled from it
+        self.code = {}
+        self.volatile = set()
+
+    def __getitem__(self, index):
+        try:
+            return self.pages[index >> PAGE_BITS][index & PAGE_MASK]
+        except KeyError:
+            return 0
+
+    def __setitem__(self, index, value):
+        if index in self.decoded:
+            del self.decoded[index]
+            if index in self.fused:
+                self.decoded.pop(self.fused.pop(index), None)
+        if index in self.code and self[index] != value:
+            self.invalidate(index)
+
+        number = index >> PAGE_BITS
+        try:
+            page = self.writable[number]
+        except KeyError:
+            if index < 0:
+                raise IndexError("Negative address {}".format(index))
+            page = self.own(number)
+        try:
+            page[index & PAGE_MASK] = value
+        except OverflowError:
+            page = self.pages[number] = self.writable[number] = page.tolist()
+            page[index & PAGE_MASK] = value
+
+    @classmethod
+    def of(cls, image: Page) -> 'Memory':
+        """Copy-on-write Memory of an image, sharing its pages with all other Memories of the same image"""
+        try:
+            base = cls._bases[id(image)][1]
+        except KeyError:
+            if len(cls._bases) >= MAX_IMAGES:
+                cls._bases.clear()
+            base = cls(image)
+            cls._bases[id(image)] = image, base
+        return base.copy()
+
+    def __len__(self):
+        return (max(self.pages) + 1) * PAGE_SIZE if self.pages else 0
+
+    def __repr__(self):
+        return "Memory({})".format(self.tolist())
+
+    def tolist(self) -> List[int]:
+        """All cells up to the last non-zero one"""
+        cells = [self[i] for i in range(len(self))]
+        while cells and cells[-1] == 0:
+            cells.pop()
+        return cells
+
+    def invalidate(self, index):
+        for start in self.code.pop(index):
+            self.blocks.pop(start, None)
+        self.volatile.add(index)
+
+    def own(self, number) -> Page:
+        """Make page number writable, copying it if it may be shared or allocating it if it does not exist yet"""
+        page = self.pages.get(number, ZERO_PAGE)
+        page = self.pages[number] = self.writable[number] = page[:]
+        return page
+
+    def freeze(self) -> Dict[int, Page]:
+        """The current pages, which are left alone from now on: writes go to copies of them"""
+        self.writable = {}
+        return dict(self.pages)
+
+    def unchanged(self, pages: Dict[int, Page]) -> bool:
+        """Whether the cells are the same as in pages returned by freeze()"""
+        if pages.keys() != self.pages.keys():
+            return False
+        return all(page is pages[number] or page == pages[number] for number, page in self.pages.items())
+
+    def copy(self) -> 'Memory':
+        """Copy-on-write copy of the cells and caches"""
+        clone = Memory()
+        clone.pages = dict(self.pages)
+        self.writable = {}
+        clone.decoded = dict(self.decoded)
+        clone.fused = dict(self.fused)
+        clone.blocks = dict(self.blocks)
+        clone.code = {cell: list(starts) for cell, starts in self.code.items()}
+        clone.volatile = set(self.volatile)
+        return clone
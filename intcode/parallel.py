@@ -0,0 +1,39 @@
+"""
+Executors for fanning independent Intcode runs out over processes. Work is submitted to a concurrent.futures
+Executor, either a ProcessPoolExecutor or an InlineExecutor that runs everything in the calling process, so
+searches are written once and run.py's --workers flag decides where they run.
+
+Functions submitted to a process pool are pickled by reference, so they have to be module level functions.
+Pass programs as images (see intcode.make_image), which pickle as a single block of bytes.
+"""
+import math
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar('T')
+
+
+class InlineExecutor(Executor):
+    """Executor that runs every call immediately in the calling process"""
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def make_executor(workers: int = 1) -> Executor:
+    """A process pool with the given number of workers, or an InlineExecutor for 1 worker or less"""
+    if workers <= 1:
+        return InlineExecutor()
+    return ProcessPoolExecutor(workers)
+
+
+def parallel_max(fn: Callable[..., T], items: Iterable, workers: int = 1) -> T:
+    """Maximum of fn(item) over all items, computed on the given number of worker processes"""
+    items = list(items)
+    with make_executor(workers) as executor:
+        chunksize = max(1, math.ceil(len(items) / (workers * 4))) if workers > 1 else 1
+        return max(executor.map(fn, items, chunksize=chunksize))
@@ -0,0 +1,118 @@
+"""
+Opcode-level profiler for Intcode runs. Records the number of instructions, a histogram per opcode and per address,
+the time spent blocked waiting on input and the output rate.
+
+Profiling is opt-in per VM and costs nothing when it is off: attaching a Profiler swaps the class of the VM for a
+profiled subclass (see intcode.instrument) that counts every instruction, so the regular dispatch loops contain no
+checks for it. Forks of a profiled VM report to the same Profiler.
+
+Profiler.enable() attaches the profiler to every VM created until disable() is called. That is what
+python run.py <day> --profile does, writing a report and a flamegraph-compatible collapsed stack file next to
+outputs/dayN_output.
+"""
+import time
+from collections import Counter
+from typing import Optional
+
+from intcode.analysis import ControlFlowGraph
+from intcode.instrument import InstrumentedVirtualMachine, instrumented
+from intcode.vm import VirtualMachine
+
+
+class Profiler:
+    def __init__(self):
+        self.instructions = 0
+        self.opcodes = Counter()
+        self.pcs = Counter()
+        self.outputs = 0
+        self.run_time = 0.0
+        self.waiting_time = 0.0
+        self.program = None
+
+    def attach(self, vm: VirtualMachine):
+        if self.program is None:
+            self.program = list(vm.initial_memory)
+        vm.profiler = self
+        vm.waiting_since = None
+        vm.__class__ = instrumented(type(vm), ProfiledVirtualMachine)
+
+    def enable(self):
+        """Attach to every VM created from now on"""
+        VirtualMachine.default_instrumentation.append(self.attach)
+
+    def disable(self):
+        if self.attach in VirtualMachine.default_instrumentation:
+            VirtualMachine.default_instrumentation.remove(self.attach)
+
+    def report(self, top=30) -> str:
+        cfg = ControlFlowGraph(self.program or [])
+        lines = [
+            "Instructions: {} in {:.3f}s ({:.0f}/s)".format(
+                self.instructions, self.run_time, self.instructions / self.run_time if self.run_time else 0),
+            "Outputs: {} ({:.0f}/s)".format(self.outputs, self.outputs / self.run_time if self.run_time else 0),
+            "Waiting for input: {:.3f}s, summed over all VMs".format(self.waiting_time),
+            "",
+            "Opcodes:",
+        ]
+        for opcode, count in self.opcodes.most_common():
+            lines.append("  {:<6}{:>12}{:>8.1%}".format(VirtualMachine.instr_set[opcode][2], count,
+                                                         count / self.instructions))
+        lines.extend(["", "Hot addresses:"])
+        for pc, count in self.pcs.most_common(top):
+            lines.append("  {:<40}{:>12}{:>8.1%}".format(str(cfg.decode(pc)), count, count / self.instructions))
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self, root="intcode") -> str:
+        """Per address counts as collapsed stacks (root;block;instruction count), grouped by basic block"""
+        cfg = ControlFlowGraph(self.program or [])
+        block_of = {instruction.pc: block.start for block in cfg.blocks.values() for instruction in block.instructions}
+        lines = []
+        for pc, count in sorted(self.pcs.items()):
+            instruction = cfg.decode(pc)
+            name = VirtualMachine.instr_set[instruction.opcode][2] if instruction.valid else "???"
+            block = block_of.get(pc)
+            lines.append("{};{};{}@{} {}".format(root, "block@{}".format(block) if block is not None else "unknown",
+                                                 name, pc, count))
+        return "\n".join(lines) + "\n"
+
+
+class ProfiledVirtualMachine(InstrumentedVirtualMachine):
+    """Counting dispatch loops, mixed in front of the class of a VM by Profiler.attach()"""
+    profiler: Profiler = None
+    waiting_since: Optional[float] = None
+
+    def resume(self):
+        """Account the time this VM spent blocked, now that input has arrived"""
+        if self.waiting_since is not None:
+            self.profiler.waiting_time += time.perf_counter() - self.waiting_since
+            self.waiting_since = None
+        super().resume()
+
+    def step(self) -> bool:
+        profiler = self.profiler
+        pc = self.pc
+        opcode = self.memory[pc] % 100
+        outputs = len(self.output_queue)
+        if super().step():
+            return True
+        if self.waiting:
+            self.waiting_since = time.perf_counter()
+            return False
+        profiler.instructions += 1
+        profiler.opcodes[opcode] += 1
+        profiler.pcs[pc] += 1
+        profiler.outputs += len(self.output_queue) - outputs
+        return False
+
+    def run_instruction(self):
+        start_time = time.perf_counter()
+        halted = super().run_instruction()
+        self.profiler.run_time += time.perf_counter() - start_time
+        return halted
+
+    def run_until(self, stop_on_input=True, max_outputs=None, max_steps=None):
+        start_time = time.perf_counter()
+        try:
+            return super().run_until(stop_on_input, max_outputs, max_steps)
+        finally:
+            self.profiler.run_time += time.perf_counter() - start_time
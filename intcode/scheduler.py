@@ -0,0 +1,174 @@
+"""
+Cooperative scheduler for networks of VMs that exchange fixed-size packets, like the day 23 network. Every VM runs
+as an asyncio coroutine that only gives up control when it has sent a packet or is blocked on input, so the
+scheduler never spends time on VMs that have nothing to do.
+
+Packets are delivered through a Router, which keeps an inbox per address. A VM that needs input gets the next packet
+from its inbox. If the inbox is empty it gets idle_value instead. Once it is spinning, blocked on input in the same
+state as the last time so that more idle values will not make it do anything (see VirtualMachine.spin_value), it
+goes to sleep until a packet arrives. Optionally, it also goes to sleep after idle_reads idle values in a row without
+having sent anything. The router counts the sleeping VMs, and once all of them are asleep the idle task wakes up and
+calls on_idle, which can send packets to get the network going again. VMs that halted count as asleep for this,
+as long as at least one VM is really asleep.
+
+Both route and on_idle can end the run with stop(result).
+"""
+import asyncio
+from collections import deque
+from typing import Callable, Deque, List, Optional, Sequence
+
+from intcode.vm import VirtualMachine, Status
+
+
+class Router:
+    def __init__(self, size: int):
+        self.inboxes: List[Deque[List[int]]] = [deque() for _ in range(size)]
+        self.asleep = [False] * size
+        self.sleeping = 0
+        self.halted = 0
+        self.wakeups = [asyncio.Event() for _ in range(size)]
+        # Set when every VM is asleep or halted, and at least one is asleep
+        self.all_asleep = asyncio.Event()
+
+    def idle(self) -> bool:
+        """Whether every VM is asleep or halted, and at least one is asleep"""
+        return self.sleeping > 0 and self.sleeping + self.halted == len(self.inboxes)
+
+    def send(self, address, packet: List[int]):
+        """Deliver a packet to the inbox of a VM, waking it up if it is asleep"""
+        self.inboxes[address].append(packet)
+        if self.asleep[address]:
+            self.asleep[address] = False
+            self.sleeping -= 1
+            self.wakeups[address].set()
+
+    async def sleep(self, address):
+        """Wait until a packet arrives for address"""
+        self.asleep[address] = True
+        self.sleeping += 1
+        if self.idle():
+            self.all_asleep.set()
+        wakeup = self.wakeups[address]
+        await wakeup.wait()
+        wakeup.clear()
+
+    def halt(self, address):
+        """Record that the VM at address halted, so the others no longer wait for it"""
+        self.halted += 1
+        if self.idle():
+            self.all_asleep.set()
+
+
+class Scheduler:
+    def __init__(self, vms: Sequence[VirtualMachine], route: Callable[[int, List[int]], None],
+                 on_idle: Optional[Callable[[], None]] = None, packet_size=3, idle_value=-1,
+                 idle_reads: Optional[int] = None):
+        self.vms = vms
+        # Called with the address of the sender and the packet for every packet a VM sends
+        self.route = route
+        self.on_idle = on_idle
+        self.packet_size = packet_size
+        self.idle_value = idle_value
+        # Number of idle values a VM reads in a row before it goes to sleep, if it is not found spinning before that
+        self.idle_reads = idle_reads
+        for vm in vms:
+            vm.spin_value = idle_value
+        # Address of the VM that is running, for error reporting
+        self.current: Optional[int] = None
+        self.router: Optional[Router] = None
+        self.result: Optional[asyncio.Future] = None
+
+    def send(self, address, packet: List[int]):
+        self.router.send(address, packet)
+
+    def stop(self, result):
+        if not self.result.done():
+            self.result.set_result(result)
+
+    async def run_vm(self, address):
+        vm = self.vms[address]
+        router = self.router
+        inbox = router.inboxes[address]
+        buffer = []
+        idle_reads = 0
+        while not self.result.done():
+            self.current = address
+            status, outputs = vm.run_until(max_outputs=self.packet_size)
+            self.current = None
+            if outputs:
+                idle_reads = 0
+                buffer.extend(outputs)
+                while len(buffer) >= self.packet_size:
+                    self.route(address, buffer[:self.packet_size])
+                    del buffer[:self.packet_size]
+                await asyncio.sleep(0)
+                continue
+            if status == Status.HALTED:
+                router.halt(address)
+                return
+
+            # Blocked on input
+            if not inbox:
+                if status != Status.SPINNING and (self.idle_reads is None or idle_reads < self.idle_reads):
+                    vm.input_queue.put(self.idle_value)
+                    idle_reads += 1
+                    await asyncio.sleep(0)
+                    continue
+                await router.sleep(address)
+            vm.input_queue.extend(inbox.popleft())
+            idle_reads = 0
+
+    async def watch_idle(self):
+        router = self.router
+        while True:
+            await router.all_asleep.wait()
+            router.all_asleep.clear()
+            if self.on_idle is not None:
+                self.on_idle()
+            if router.idle() and not self.result.done():
+                raise RuntimeError("Every VM is waiting for input and no packets were sent")
+
+    async def run(self):
+        """Run until stop() is called, or until every VM has halted (returns None)"""
+        self.result = asyncio.get_running_loop().create_future()
+        self.router = Router(len(self.vms))
+        vm_tasks = [asyncio.create_task(self.run_vm(address)) for address in range(len(self.vms))]
+        tasks = vm_tasks + [asyncio.create_task(self.watch_idle())]
+        try:
+            pending = set(tasks) | {self.result}
+            while not self.result.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not self.result:
+                        # Raises the exception of a failed task
+                        task.result()
+                if all(task.done() for task in vm_tasks):
+                    return None
+            return self.result.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def main():
+    # One VM halts right away, the other polls for input until it sleeps. The network is idle and no packets
+    # are sent, so the run has to fail instead of waiting for the halted VM.
+    for idle_reads in (4, None):
+        vms = [VirtualMachine([99]), VirtualMachine([3, 10, 1105, 1, 0])]
+        scheduler = Scheduler(vms, lambda address, packet: None, idle_reads=idle_reads)
+        try:
+            asyncio.run(asyncio.wait_for(scheduler.run(), 5))
+        except RuntimeError as e:
+            print("idle_reads={}: {}".format(idle_reads, e))
+        else:
+            raise AssertionError("A network of halted and sleeping VMs did not report that it is stuck")
+    # When every VM halts, the run ends without a result
+    vms = [VirtualMachine([99]), VirtualMachine([99])]
+    result = asyncio.run(asyncio.wait_for(Scheduler(vms, lambda address, packet: None).run(), 5))
+    if result is not None:
+        raise AssertionError("A network of halted VMs returned {}".format(result))
+    print("Halted VMs: returned None")
+
+
+if __name__ == "__main__":
+    main()
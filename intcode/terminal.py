@@ -0,0 +1,78 @@
+"""
+ASCII terminal on top of the channels of a VM, for the days where the program talks in text (17, 21 and 25).
+Commands are encoded into the input channel in one go, and output is collected in a bytearray and decoded a run at
+a time instead of per character. Complete lines can be streamed to a callback as they come in.
+
+Programs end their text with a single value that is not ASCII (the puzzle answer). The first such value stops
+decoding and is returned separately as AsciiResult.value.
+"""
+from typing import Callable, Iterable, List, Optional
+
+from intcode.vm import VirtualMachine, Status
+from intcode.watchdog import Watchdog
+
+
+def encode(commands: Iterable[str]) -> bytes:
+    """Commands as program input, one per line"""
+    return "".join(command + "\n" for command in commands).encode("ascii")
+
+
+class AsciiResult:
+    """Outcome of AsciiIO.run()"""
+    def __init__(self, status: Status, text: str, value: Optional[int] = None):
+        self.status = status
+        self.text = text
+        # The first output that is not ASCII, if there was one
+        self.value = value
+
+    @property
+    def lines(self) -> List[str]:
+        return self.text.split("\n")
+
+
+class AsciiIO:
+    def __init__(self, vm: VirtualMachine, on_line: Optional[Callable[[str], None]] = None,
+                 watchdog: Optional[Watchdog] = None):
+        self.vm = vm
+        # Called with every complete line of output, without the newline
+        self.on_line = on_line
+        # Limits for every run, if any
+        self.watchdog = watchdog
+        # Output of the current run, preceded by the unfinished last line of the previous one
+        self.output = bytearray()
+        self.line_start = 0
+
+    def send(self, *commands: str):
+        self.vm.input_queue.extend(encode(commands))
+
+    def decode(self, outputs: List[int]) -> Optional[int]:
+        """Add outputs to the text up to the first value that is not ASCII, which is returned"""
+        value = None
+        if outputs and (max(outputs) > 127 or min(outputs) < 0):
+            end = next(i for i, output in enumerate(outputs) if not 0 <= output <= 127)
+            value = outputs[end]
+            outputs = outputs[:end]
+        self.output += bytes(outputs)
+
+        end = self.output.rfind(b"\n")
+        if end >= self.line_start:
+            if self.on_line is not None:
+                for line in self.output[self.line_start:end].decode("ascii").split("\n"):
+                    self.on_line(line)
+            self.line_start = end + 1
+        return value
+
+    def read(self, status: Status, outputs: List[int]) -> AsciiResult:
+        """Decode the outputs of a run that stopped with status"""
+        del self.output[:self.line_start]
+        self.line_start = 0
+        start = len(self.output)
+        value = self.decode(outputs)
+        return AsciiResult(status, self.output[start:].decode("ascii"), value)
+
+    def run(self, *commands: str, stop_on_input=True) -> AsciiResult:
+        """Send commands and run until the program asks for more input or halts"""
+        self.send(*commands)
+        if self.watchdog is not None:
+            return self.read(*self.watchdog.run_until(self.vm, stop_on_input=stop_on_input))
+        return self.read(*self.vm.run_until(stop_on_input=stop_on_input))
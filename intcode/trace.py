@@ -0,0 +1,187 @@
+"""
+Execution trace ring buffer. A traced VM records every instruction it executes as a fixed-size record of packed
+64-bit integers in an array, keeping only the last TraceBuffer.size records:
+
+    pc, instruction word, first operand, second operand, written address (-1 if none), written value
+
+Operands are resolved values: the inputs of add/mult/lt/eq, the condition and target of a jump, the output value,
+the read input and the relative base offset. Values that do not fit in 64 bits are stored wrapped around.
+
+Like profiling, tracing is attached by swapping the class of a VM (see intcode.instrument), so untraced VMs pay
+nothing for it. When an exception escapes a traced VM, its buffer is dumped to TraceBuffer.path if one is set.
+python run.py <day> --trace does that for every VM, writing to outputs/dayN_output.trace.
+
+Decode a dump with: python -m intcode.trace FILE [--last N]
+"""
+import struct
+import sys
+from array import array
+from typing import Iterator, Optional, Tuple
+
+from intcode.compiler import NARGS
+from intcode.instrument import InstrumentedVirtualMachine, instrumented
+from intcode.vm import (
+    VirtualMachine, decode,
+    INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_OUT, INSTR_JIT, INSTR_JIF, INSTR_LT, INSTR_EQ, INSTR_REB,
+)
+
+FIELDS = 6
+MAGIC = b"ICTR"
+# Magic, buffer size in records, total number of recorded instructions. Followed by the raw buffer.
+HEADER = struct.Struct("<4sQQ")
+
+WRITES = (INSTR_ADD, INSTR_MUL, INSTR_INP, INSTR_LT, INSTR_EQ)
+
+Record = Tuple[int, int, int, int, int, int]
+
+
+def wrap(value):
+    """Wrap a value into the signed 64-bit range"""
+    return (value + (1 << 63)) % (1 << 64) - (1 << 63)
+
+
+class TraceBuffer:
+    # Set by enable()
+    default_size = 4096
+    default_path: Optional[str] = None
+
+    def __init__(self, size=4096, path: Optional[str] = None):
+        self.size = size
+        self.path = path
+        self.records = array('q', bytes(8 * FIELDS * size))
+        # Total number of records written, the next one goes to index count % size
+        self.count = 0
+
+    def record(self, pc, word, x, y, address, value):
+        i = self.count % self.size * FIELDS
+        records = self.records
+        try:
+            records[i] = pc
+            records[i + 1] = word
+            records[i + 2] = x
+            records[i + 3] = y
+            records[i + 4] = address
+            records[i + 5] = value
+        except OverflowError:
+            records[i:i + FIELDS] = array('q', map(wrap, (pc, word, x, y, address, value)))
+        self.count += 1
+
+    def __iter__(self) -> Iterator[Record]:
+        """Records, oldest first"""
+        first = max(0, self.count - self.size)
+        for n in range(first, self.count):
+            i = n % self.size * FIELDS
+            yield tuple(self.records[i:i + FIELDS])
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def dump(self, path: Optional[str] = None) -> str:
+        path = path or self.path
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.size, self.count))
+            f.write(self.records.tobytes())
+        return path
+
+    @classmethod
+    def load(cls, path) -> 'TraceBuffer':
+        with open(path, 'rb') as f:
+            magic, size, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not an Intcode trace".format(path))
+            trace = cls(size)
+            trace.records = array('q')
+            trace.records.frombytes(f.read())
+        trace.count = count
+        return trace
+
+    def attach(self, vm: VirtualMachine):
+        vm.trace = self
+        vm.__class__ = instrumented(type(vm), TracedVirtualMachine)
+
+    @classmethod
+    def enable(cls, size=4096, path: Optional[str] = None):
+        """Attach a new buffer to every VM created from now on"""
+        cls.default_size = size
+        cls.default_path = path
+        VirtualMachine.default_instrumentation.append(cls.attach_new)
+
+    @classmethod
+    def disable(cls):
+        if cls.attach_new in VirtualMachine.default_instrumentation:
+            VirtualMachine.default_instrumentation.remove(cls.attach_new)
+
+    @classmethod
+    def attach_new(cls, vm: VirtualMachine):
+        cls(cls.default_size, cls.default_path).attach(vm)
+
+
+def format_record(record: Record) -> str:
+    pc, word, x, y, address, value = record
+    opcode, modes = decode(word)
+    try:
+        name = VirtualMachine.instr_set[opcode][2]
+    except KeyError:
+        return "{}: ??? {}".format(pc, word)
+    if opcode in (INSTR_ADD, INSTR_MUL, INSTR_LT, INSTR_EQ):
+        return "{}: {} {} {} -> [{}] = {}".format(pc, name, x, y, address, value)
+    elif opcode == INSTR_INP:
+        return "{}: {} -> [{}] = {}".format(pc, name, address, value)
+    elif opcode == INSTR_OUT:
+        return "{}: {} {}".format(pc, name, x)
+    elif opcode == INSTR_REB:
+        return "{}: {} {} -> rb = {}".format(pc, name, x, value)
+    elif NARGS.get(opcode) == 2:
+        return "{}: {} {} -> {}".format(pc, name, x, "jump {}".format(y) if value else "no jump")
+    return "{}: {}".format(pc, name)
+
+
+class TracedVirtualMachine(InstrumentedVirtualMachine):
+    """Recording dispatch loops, mixed in front of the class of a VM by TraceBuffer.attach()"""
+    trace: TraceBuffer = None
+
+    def step(self) -> bool:
+        memory = self.memory
+        pc = self.pc
+        word = memory[pc]
+        opcode, modes = decode(word)
+        narg = NARGS.get(opcode, 0)
+        x = self.value(modes[0], memory[pc + 1]) if narg > 1 or opcode in (INSTR_OUT, INSTR_REB) else 0
+        y = self.value(modes[1], memory[pc + 2]) if narg > 1 else 0
+        address = self.address(modes[narg - 1], memory[pc + narg]) if opcode in WRITES else -1
+
+        try:
+            halted = super().step()
+        except Exception:
+            if self.trace.path is not None:
+                self.trace.dump()
+            raise
+        if self.waiting:
+            return halted
+
+        if address >= 0:
+            value = memory[address]
+        elif opcode == INSTR_REB:
+            value = self.relative_base
+        else:
+            # Whether a jump was taken, from its condition: a taken jump can also land on pc + 3
+            value = 1 if opcode == INSTR_JIT and x != 0 or opcode == INSTR_JIF and x == 0 else 0
+        self.trace.record(pc, word, x, y, address, value)
+        return halted
+
+
+def main(args):
+    if not args:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    trace = TraceBuffer.load(args[0])
+    records = list(trace)
+    if "--last" in args:
+        records = records[-int(args[args.index("--last") + 1]):]
+    print("{} instructions recorded, showing the last {}".format(trace.count, len(records)))
+    for record in records:
+        print(format_record(record))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,331 @@
+import copy
+from enum import Enum
+from typing import Iterable, List, Optional, Tuple
+
+from intcode.channel import Channel
+from intcode.memory import Memory, make_image
+
+INSTR_ADD = 1
+INSTR_MUL = 2
+INSTR_INP = 3
+INSTR_OUT = 4
+INSTR_JIT = 5
+INSTR_JIF = 6
+INSTR_LT = 7
+INSTR_EQ = 8
+INSTR_REB = 9
+INSTR_END = 99
+
+MODE_POS = 0
+MODE_IMM = 1
+MODE_REL = 2
+
+
+class Status(Enum):
+    HALTED = "halted"
+    # Blocked on an input instruction while the input channel is empty
+    WAITING = "waiting"
+    # Produced the requested number of outputs
+    OUTPUT = "output"
+    # Ran the requested number of steps
+    STEPS = "steps"
+    # Blocked on input in the same state as the previous time, having only read spin_value since then
+    SPINNING = "spinning"
+    # A breakpoint or other hook asked to pause, see intcode.hooks
+    BREAKPOINT = "breakpoint"
+
+
+class Snapshot:
+    """Saved VM state, see VirtualMachine.snapshot(). The memory is shared copy-on-write with the VM it came from."""
+    def __init__(self, memory: Memory, pc: int, relative_base: int, waiting: bool,
+                 inputs: Tuple[int, ...], outputs: Tuple[int, ...]):
+        self.memory = memory
+        self.pc = pc
+        self.relative_base = relative_base
+        self.waiting = waiting
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+def add(vm: 'VirtualMachine', modes, x, y, addr):
+    vm.memory[vm.address(modes[2], addr)] = vm.value(modes[0], x) + vm.value(modes[1], y)
+
+
+def mult(vm: 'VirtualMachine', modes, x, y, addr):
+    vm.memory[vm.address(modes[2], addr)] = vm.value(modes[0], x) * vm.value(modes[1], y)
+
+
+def i_input(vm: 'VirtualMachine', modes, addr):
+    if not vm.input_queue:
+        return True
+    vm.memory[vm.address(modes[0], addr)] = vm.input_queue.get()
+    return False
+
+
+def output(vm: 'VirtualMachine', modes, x):
+    vm.output_queue.put(vm.value(modes[0], x))
+
+
+def jump_if_true(vm: 'VirtualMachine', modes, x, addr):
+    if vm.value(modes[0], x) != 0:
+        vm.pc = vm.value(modes[1], addr)
+
+
+def jump_if_false(vm: 'VirtualMachine', modes, x, addr):
+    if vm.value(modes[0], x) == 0:
+        vm.pc = vm.value(modes[1], addr)
+
+
+def less_than(vm: 'VirtualMachine', modes, x, y, addr):
+    vm.memory[vm.address(modes[2], addr)] = 1 if vm.value(modes[0], x) < vm.value(modes[1], y) else 0
+
+
+def equals(vm: 'VirtualMachine', modes, x, y, addr):
+    vm.memory[vm.address(modes[2], addr)] = 1 if vm.value(modes[0], x) == vm.value(modes[1], y) else 0
+
+
+def rebase(vm: 'VirtualMachine', modes, x):
+    vm.relative_base += vm.value(modes[0], x)
+
+
+def decode(instr):
+    """Split an instruction into its opcode and a tuple of three parameter modes"""
+    return instr % 100, (instr // 100 % 10, instr // 1000 % 10, instr // 10000 % 10)
+
+
+class VirtualMachine:
+    instr_set = {
+        # CONST: (func, nargs, name)
+        INSTR_ADD: (add, 3, "add"),
+        INSTR_MUL: (mult, 3, "mult"),
+        INSTR_INP: (i_input, 1, "in"),
+        INSTR_OUT: (output, 1, "out"),
+        INSTR_JIT: (jump_if_true, 2, "jit"),
+        INSTR_JIF: (jump_if_false, 2, "jif"),
+        INSTR_LT: (less_than, 3, "lt"),
+        INSTR_EQ: (equals, 3, "eq"),
+        INSTR_REB: (rebase, 1, "reb"),
+
+        INSTR_END: (None, 0, "end"),
+    }
+
+    # Called with every new VM, used to attach instrumentation such as intcode.profiler to all VMs
+    default_instrumentation = []
+
+    # Input value that a driver feeds when it has nothing to send, like the -1 of the day 23 network. If set,
+    # run_until() reports SPINNING instead of WAITING when the VM is back at a blocking input with the same pc,
+    # relative base and memory as when it last blocked, having read only spin_value in between: it is polling,
+    # and will not do anything new until it gets other input.
+    spin_value: Optional[int] = None
+
+    # Number of steps the last run_until() ran, including the instruction that produced the last output
+    steps_run = 0
+
+    def __init__(self, program: Optional[Iterable[int]] = None,
+                 input_queue: Optional[Channel] = None, output_queue: Optional[Channel] = None):
+        self.initial_memory = make_image(program or ())
+        self.memory = Memory.of(self.initial_memory)
+        self.input_queue = input_queue if input_queue is not None else Channel()
+        self.output_queue = output_queue if output_queue is not None else Channel()
+        self.waiting = False
+        self.pc = 0
+        self.relative_base = 0
+        # (pc, relative base, memory pages) when the VM last blocked on input, see spinning()
+        self.spin_state = None
+        # Whether all input since then was spin_value
+        self.spin_fed = False
+        for attach in self.default_instrumentation:
+            attach(self)
+
+    def load(self, program: Iterable[int]):
+        self.initial_memory = make_image(program)
+        self.reset()
+
+    def reset(self):
+        self.memory = Memory.of(self.initial_memory)
+        self.input_queue.clear()
+        self.output_queue.clear()
+        self.waiting = False
+        self.pc = 0
+        self.relative_base = 0
+        self.spin_state = None
+
+    def snapshot(self) -> Snapshot:
+        """Capture the current state. Cheap, memory pages are only copied once the VM writes to them."""
+        return Snapshot(self.memory.copy(), self.pc, self.relative_base, self.waiting,
+                        tuple(self.input_queue), tuple(self.output_queue))
+
+    def restore(self, snapshot: Snapshot):
+        """Return to a snapshot. The same snapshot can be restored any number of times."""
+        self.memory = snapshot.memory.copy()
+        self.pc = snapshot.pc
+        self.relative_base = snapshot.relative_base
+        self.waiting = snapshot.waiting
+        self.input_queue.clear()
+        self.input_queue.extend(snapshot.inputs)
+        self.output_queue.clear()
+        self.output_queue.extend(snapshot.outputs)
+        self.spin_state = None
+
+    def save(self, path, info: Optional[dict] = None):
+        """Write a checkpoint of the current state to a file, with optional JSON info for the driver"""
+        from intcode import checkpoint
+        checkpoint.save(self, path, info)
+
+    def load_checkpoint(self, path) -> Optional[dict]:
+        """Continue from a checkpoint written by save() from a VM with the same program. Returns its info."""
+        from intcode import checkpoint
+        return checkpoint.load(self, path)
+
+    def fork(self) -> 'VirtualMachine':
+        """
+        Independent copy of this VM, sharing memory copy-on-write. The copy gets its own channels holding the
+        current contents of ours, so forking a VM that is connected to others (like the day 7 amplifiers)
+        disconnects the fork.
+        """
+        vm = copy.copy(self)
+        vm.memory = self.memory.copy()
+        vm.input_queue = Channel(self.input_queue)
+        vm.output_queue = Channel(self.output_queue)
+        return vm
+
+    def initialize(self):
+        self.pc = 0
+        self.relative_base = 0
+
+    @property
+    def halted(self):
+        return self.memory[self.pc] == INSTR_END
+
+    def value(self, mode, param):
+        if mode == MODE_POS:
+            return self.memory[param]
+        elif mode == MODE_REL:
+            return self.memory[self.relative_base + param]
+        return param
+
+    def address(self, mode, param):
+        if mode == MODE_REL:
+            return self.relative_base + param
+        return param
+
+    def decode_instruction(self, pc):
+        opcode, modes = decode(self.memory[pc])
+        instr_func, instr_narg, _ = self.instr_set[opcode]
+        return instr_func, modes, instr_narg
+
+    def disassemble(self, pc):
+        opcode, modes = decode(self.memory[pc])
+        _, narg, name = self.instr_set[opcode]
+        params = ("{}{}".format("@I#"[modes[i]], self.memory[pc + 1 + i]) for i in range(narg))
+        return "{}: {} {}".format(pc, name, " ".join(params))
+
+    def run_instruction(self):
+        """
+        Run a single instruction. Returns True once the program has halted, False otherwise
+        (including when the VM is blocked waiting for input).
+        """
+        if self.waiting:
+            if not self.input_queue:
+                return False
+            self.waiting = False
+
+        pc = self.pc
+        memory = self.memory
+        try:
+            instr_func, modes, instr_narg = memory.decoded[pc]
+        except KeyError:
+            instr_func, modes, instr_narg = memory.decoded[pc] = self.decode_instruction(pc)
+        if instr_func is None:
+            # INSTR_END
+            return True
+
+        self.pc = pc + 1 + instr_narg
+        if instr_narg == 3:
+            blocked = instr_func(self, modes, memory[pc + 1], memory[pc + 2], memory[pc + 3])
+        elif instr_narg == 2:
+            blocked = instr_func(self, modes, memory[pc + 1], memory[pc + 2])
+        else:
+            blocked = instr_func(self, modes, memory[pc + 1])
+        if blocked:
+            # Blocked on input, retry this instruction once input is available
+            self.pc = pc
+            self.waiting = True
+        return False
+
+    def run_until(self, stop_on_input=True, max_outputs: Optional[int] = None,
+                  max_steps: Optional[int] = None) -> Tuple[Status, List[int]]:
+        """
+        Run until the program halts, blocks on input, has produced max_outputs outputs or has run max_steps
+        instructions. Returns the reason it stopped and everything drained from the output channel.
+        With stop_on_input=False the caller promises all input has been provided, and blocking on input is an error.
+        The number of instructions it ran is left in steps_run.
+        """
+        if self.waiting:
+            if not self.input_queue:
+                return self._stopped(Status.WAITING, stop_on_input)
+            self.waiting = False
+            self.resume()
+
+        memory = self.memory
+        decoded = memory.decoded
+        outputs = self.output_queue
+        output_limit = len(outputs) + max_outputs if max_outputs is not None else -1
+        limit = steps = max_steps if max_steps is not None else -1
+        while steps:
+            pc = self.pc
+            try:
+                instr_func, modes, instr_narg = decoded[pc]
+            except KeyError:
+                instr_func, modes, instr_narg = decoded[pc] = self.decode_instruction(pc)
+            if instr_func is None:
+                return self._stopped(Status.HALTED, stop_on_input, limit - steps)
+
+            self.pc = pc + 1 + instr_narg
+            if instr_narg == 3:
+                instr_func(self, modes, memory[pc + 1], memory[pc + 2], memory[pc + 3])
+            elif instr_narg == 2:
+                instr_func(self, modes, memory[pc + 1], memory[pc + 2])
+            elif instr_func is output:
+                output(self, modes, memory[pc + 1])
+                if len(outputs) == output_limit:
+                    return self._stopped(Status.OUTPUT, stop_on_input, limit - steps + 1)
+            elif instr_func(self, modes, memory[pc + 1]):
+                self.pc = pc
+                self.waiting = True
+                return self._stopped(Status.WAITING, stop_on_input, limit - steps)
+            steps -= 1
+        return self._stopped(Status.STEPS, stop_on_input, limit - steps)
+
+    def resume(self):
+        """Called when the VM continues after blocking on input, now that input has arrived"""
+        if self.spin_value is not None:
+            self.spin_fed = all(value == self.spin_value for value in self.input_queue)
+
+    def spinning(self) -> bool:
+        """Whether the VM, blocked on input, is in the same state as when it last blocked. Records the state."""
+        state = self.spin_state
+        if (state is not None and self.spin_fed and not self.output_queue and state[0] == self.pc and
+                state[1] == self.relative_base and self.memory.unchanged(state[2])):
+            return True
+        self.spin_state = self.pc, self.relative_base, self.memory.freeze()
+        return False
+
+    def _stopped(self, status: Status, stop_on_input, steps_run=0) -> Tuple[Status, List[int]]:
+        self.steps_run = steps_run
+        if status == Status.WAITING:
+            if not stop_on_input:
+                raise RuntimeError("Program blocked on input at {} while all input was expected to be provided".format(self.pc))
+            if self.spin_value is not None and self.spinning():
+                status = Status.SPINNING
+        elif self.spin_value is not None:
+            self.spin_state = None
+        return status, self.output_queue.drain()
+
+    def run_program(self):
+        self.initialize()
+
+        while not self.run_instruction():
+            pass
+
+        return self.memory[0]
@@ -0,0 +1,138 @@
+"""
+Limits for Intcode runs, so a bad input makes a run fail fast instead of hanging. Watchdog.run_until() runs a VM in
+slices of run_until(max_steps=...) and checks between slices:
+
+- the number of instructions run (dispatches, for compiled VMs), as counted by run_until() in steps_run
+- the wall-clock time
+- the number of outputs
+- whether the VM is stuck in a loop: at every slice boundary it samples the pc, relative base, pending input and a
+  hash of memory (see LoopDetector). Seeing the same sample twice means the VM came back to exactly the same state, so it will go
+  around that loop forever
+
+A run that goes over a limit raises a LimitExceeded with a summary of the VM state. The checks only cost something
+once per slice, so the VM runs at full speed in between.
+"""
+import time
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from intcode.memory import Page
+from intcode.vm import VirtualMachine, Status
+
+DEFAULT_SLICE = 10000
+# Number of state samples kept for loop detection
+MAX_SAMPLES = 4096
+
+
+class LimitExceeded(RuntimeError):
+    def __init__(self, reason: str, vm: VirtualMachine, instructions: int, elapsed: float, outputs: int):
+        self.reason = reason
+        self.pc = vm.pc
+        self.relative_base = vm.relative_base
+        self.instructions = instructions
+        self.elapsed = elapsed
+        self.outputs = outputs
+        try:
+            instruction = vm.disassemble(vm.pc)
+        except Exception:
+            instruction = "???"
+        self.instruction = instruction
+        super().__init__("{} at pc {} ({}), relative base {}, after {} instructions, {:.3f}s and {} outputs".format(
+            reason, self.pc, instruction, self.relative_base, instructions, elapsed, outputs))
+
+
+class InstructionLimitExceeded(LimitExceeded):
+    pass
+
+
+class TimeLimitExceeded(LimitExceeded):
+    pass
+
+
+class OutputLimitExceeded(LimitExceeded):
+    pass
+
+
+class InfiniteLoopDetected(LimitExceeded):
+    pass
+
+
+class LoopDetector:
+    """
+    Samples of the VM state, to notice when a sample comes up twice. Hashing all of memory for every sample would
+    get expensive for large programs, so memory is frozen after every sample (see Memory.freeze): pages that were
+    not written to since are the same objects as last time and keep their hash, and only the recently written pages,
+    which the VM had to copy, are hashed again.
+    """
+    def __init__(self):
+        self.samples: Set[Tuple[int, int, Tuple[int, ...], int]] = set()
+        # id(page) -> (page, hash), holding on to the page so its id is not reused
+        self.hashes: Dict[int, Tuple[Page, int]] = {}
+
+    def page_hash(self, page: Page) -> int:
+        try:
+            return self.hashes[id(page)][1]
+        except KeyError:
+            value = hash(page.tobytes() if isinstance(page, array) else tuple(page))
+            self.hashes[id(page)] = page, value
+            return value
+
+    def sample(self, vm: VirtualMachine) -> bool:
+        """Record the state of vm. Returns whether it was in the same state before."""
+        memory = vm.memory
+        cells = hash(tuple((number, self.page_hash(page)) for number, page in sorted(memory.pages.items())))
+        memory.freeze()
+        state = vm.pc, vm.relative_base, tuple(vm.input_queue), cells
+        if state in self.samples:
+            return True
+        if len(self.samples) >= MAX_SAMPLES:
+            self.samples.clear()
+            self.hashes = {id(page): (page, value) for page, value in self.hashes.values()
+                           if any(page is p for p in memory.pages.values())}
+        self.samples.add(state)
+        return False
+
+
+class Watchdog:
+    def __init__(self, max_instructions: Optional[int] = None, max_seconds: Optional[float] = None,
+                 max_outputs: Optional[int] = None, detect_loops=True, slice_size=DEFAULT_SLICE):
+        self.max_instructions = max_instructions
+        self.max_seconds = max_seconds
+        self.max_outputs = max_outputs
+        self.detect_loops = detect_loops
+        self.slice_size = slice_size
+
+    def run_until(self, vm: VirtualMachine, stop_on_input=True,
+                  max_outputs: Optional[int] = None) -> Tuple[Status, List[int]]:
+        """Like vm.run_until(), but raises a LimitExceeded when the run goes over a limit"""
+        start_time = time.perf_counter()
+        instructions = 0
+        outputs: List[int] = []
+        loops = LoopDetector() if self.detect_loops else None
+        while True:
+            steps = self.slice_size
+            if self.max_instructions is not None:
+                steps = min(steps, self.max_instructions - instructions + 1)
+            wanted = max_outputs - len(outputs) if max_outputs is not None else None
+            if self.max_outputs is not None:
+                # Stop right after the output that goes over the limit
+                over = self.max_outputs - len(outputs) + 1
+                wanted = min(wanted, over) if wanted is not None else over
+            status, output = vm.run_until(stop_on_input, max_outputs=wanted, max_steps=steps)
+            outputs.extend(output)
+            instructions += vm.steps_run
+            elapsed = time.perf_counter() - start_time
+
+            if self.max_outputs is not None and len(outputs) > self.max_outputs:
+                raise OutputLimitExceeded("Output limit of {} exceeded".format(self.max_outputs),
+                                          vm, instructions, elapsed, len(outputs))
+            if status != Status.STEPS:
+                return status, outputs
+            if self.max_instructions is not None and instructions > self.max_instructions:
+                raise InstructionLimitExceeded("Instruction limit of {} exceeded".format(self.max_instructions),
+                                               vm, instructions, elapsed, len(outputs))
+            if self.max_seconds is not None and elapsed > self.max_seconds:
+                raise TimeLimitExceeded("Time limit of {}s exceeded".format(self.max_seconds),
+                                        vm, instructions, elapsed, len(outputs))
+            if loops is not None and loops.sample(vm):
+                raise InfiniteLoopDetected("Stuck in a loop", vm, instructions, elapsed, len(outputs))
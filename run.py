@@ -5,8 +5,41 @@ import sys
 import traceback
 import os
 
+from intcode.cache import RunCache
+
 if __name__ == "__main__":
     run_everything = False
+    workers = 1
+    if "--workers" in sys.argv:
+        index = sys.argv.index("--workers")
+        try:
+            workers = int(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            print("--workers needs a number of worker processes")
+            sys.exit(1)
+        del sys.argv[index:index + 2]
+
+    profile = "--profile" in sys.argv
+    if profile:
+        sys.argv.remove("--profile")
+    trace = "--trace" in sys.argv
+    if trace:
+        sys.argv.remove("--trace")
+    resume = "--resume" in sys.argv
+    if resume:
+        sys.argv.remove("--resume")
+    run_cache = None
+    if "--cache" in sys.argv:
+        sys.argv.remove("--cache")
+        run_cache = RunCache()
+    if "--cache-db" in sys.argv:
+        index = sys.argv.index("--cache-db")
+        if index + 1 >= len(sys.argv):
+            print("--cache-db needs the path of a database file")
+            sys.exit(1)
+        run_cache = RunCache(path=sys.argv[index + 1])
+        del sys.argv[index:index + 2]
+
     if len(sys.argv) >= 2:
         try:
             if sys.argv[1] == "all":
@@ -16,7 +49,7 @@ if __name__ == "__main__":
                 day_number = int(sys.argv[1])
         except Exception:
             print("{} - Runs a given AoC day (or the current day if no arguments are given)".format(sys.argv[0]))
-            print("Usage: {} [day]".format(sys.argv[0]))
+            print("Usage: {} [day] [--workers N] [--profile] [--trace] [--resume] [--cache | --cache-db FILE]".format(sys.argv[0]))
             sys.exit(1)
     else:
         day_number = datetime.date.today().day
@@ -54,6 +87,11 @@ if __name__ == "__main__":
                 # noinspection PyBroadException
                 try:
                     instance = someones_day(year, d, session_token)
+                    instance.workers = workers
+                    instance.profile = profile
+                    instance.trace = trace
+                    instance.resume = resume
+                    instance.run_cache = run_cache
                     instance.run()
                 except ConnectionError as e:
                     print(e, file=sys.stderr)
@@ -77,3 +115,5 @@ if __name__ == "__main__":
                 print("Attempting to run AoC day {}...".format(d))
                 print("I have nothing to run for day {}".format(d))
 
+    if run_cache is not None:
+        run_cache.close()